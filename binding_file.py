@@ -0,0 +1,311 @@
+import mmap
+import os
+import struct
+import zlib
+
+# A binding file holds the same data as the json output of the lib*.py
+# scripts, but it can be mapped into memory and read one entry at a time.
+# Numbers are little endian. The file starts with a header and a directory
+# of sections, followed by the string table, the values and the sections.
+#
+#   header:    magic, version, section count,
+#              strings base, strings size, values base, values size
+#   directory: name, kind, offset, count -- for every section
+#
+# A dict in the data becomes an INDEX section: a hash table of `count`
+# slots of (crc32 of the name, name, value), probed linearly. A list
+# becomes an ARRAY of `count` values, and anything else a single VALUE.
+#
+# A string is an offset into the string table, where it's stored with a
+# length prefix. A value is an offset into the values, where it starts
+# with a tag character:
+#
+#   N None, T True, F False, i int64, u uint64, d double, s string,
+#   l list: count, values...
+#   m dict: count, (string, value)...
+
+magic = 'CFGB'
+version = 1
+
+INDEX, ARRAY, VALUE = range(3)
+empty = 0xFFFFFFFF
+
+header_format = struct.Struct('<4sIIIIII')
+section_format = struct.Struct('<IIII')
+slot_format = struct.Struct('<III')
+u32 = struct.Struct('<I')
+i64 = struct.Struct('<q')
+u64 = struct.Struct('<Q')
+f64 = struct.Struct('<d')
+
+def name_hash(name):
+    return zlib.crc32(name) & 0xFFFFFFFF
+
+def dump(data, path):
+    "Writes the dict into a binding file."
+    writer = Writer()
+    sections = []
+    for name in sorted(data):
+        value = data[name]
+        if isinstance(value, dict):
+            sections.append((writer.string(name), INDEX, writer.index(value)))
+        elif isinstance(value, list):
+            sections.append((writer.string(name), ARRAY, writer.array(value)))
+        else:
+            sections.append((writer.string(name), VALUE, writer.value(value)))
+
+    strings = ''.join(writer.string_data)
+    values = ''.join(writer.value_data)
+    strings_base = header_format.size + section_format.size * len(sections)
+    values_base = strings_base + len(strings)
+    offset = values_base + len(values)
+    directory = []
+    tables = []
+    for name, kind, table in sections:
+        if kind == VALUE:
+            directory.append(section_format.pack(name, kind, table, 1))
+            continue
+        count = len(table) // (slot_format.size if kind == INDEX else u32.size)
+        directory.append(section_format.pack(name, kind, offset, count))
+        tables.append(table)
+        offset += len(table)
+
+    temp_path = '{}.{}'.format(path, os.getpid())
+    with open(temp_path, 'wb') as fd:
+        fd.write(header_format.pack(magic, version, len(sections),
+            strings_base, len(strings), values_base, len(values)))
+        fd.write(''.join(directory))
+        fd.write(strings)
+        fd.write(values)
+        fd.write(''.join(tables))
+    os.rename(temp_path, path)
+
+class Writer(object):
+    def __init__(self):
+        self.strings = {}
+        self.string_data = []
+        self.string_size = 0
+        self.value_data = []
+        self.value_size = 0
+
+    def string(self, string):
+        if isinstance(string, unicode):
+            string = string.encode('utf-8')
+        if string not in self.strings:
+            self.strings[string] = self.string_size
+            data = u32.pack(len(string)) + string
+            self.string_data.append(data)
+            self.string_size += len(data)
+        return self.strings[string]
+
+    def value(self, value):
+        offset = self.value_size
+        data = ''.join(self.encode(value))
+        self.value_data.append(data)
+        self.value_size += len(data)
+        return offset
+
+    def encode(self, value):
+        if value is None:
+            yield 'N'
+        elif value is True:
+            yield 'T'
+        elif value is False:
+            yield 'F'
+        elif isinstance(value, (int, long)):
+            if value >= 1 << 63:
+                yield 'u' + u64.pack(value)
+            else:
+                yield 'i' + i64.pack(value)
+        elif isinstance(value, float):
+            yield 'd' + f64.pack(value)
+        elif isinstance(value, basestring):
+            yield 's' + u32.pack(self.string(value))
+        elif isinstance(value, (list, tuple)):
+            yield 'l' + u32.pack(len(value))
+            for item in value:
+                for data in self.encode(item):
+                    yield data
+        elif isinstance(value, dict):
+            yield 'm' + u32.pack(len(value))
+            for name in sorted(value):
+                yield u32.pack(self.string(name))
+                for data in self.encode(value[name]):
+                    yield data
+        else:
+            raise TypeError("%r cannot be stored in a binding file" % (value,))
+
+    def array(self, values):
+        return ''.join(u32.pack(self.value(value)) for value in values)
+
+    def index(self, values):
+        count = 1
+        while count <= len(values) * 2:
+            count *= 2
+        slots = [None] * count
+        for name in sorted(values):
+            string = self.string(name)
+            value = self.value(values[name])
+            if isinstance(name, unicode):
+                name = name.encode('utf-8')
+            digest = name_hash(name)
+            i = digest & (count - 1)
+            while slots[i] is not None:
+                i = (i + 1) & (count - 1)
+            slots[i] = slot_format.pack(digest, string, value)
+        return ''.join(slot or slot_format.pack(0, empty, 0) for slot in slots)
+
+class BindingFile(object):
+    "Reads a binding file through mmap, decoding entries as they're asked for."
+    def __init__(self, path):
+        with open(path, 'rb') as fd:
+            self.data = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        (file_magic, file_version, section_count, self.strings_base, strings_size,
+            self.values_base, values_size) = header_format.unpack_from(self.data, 0)
+        if file_magic != magic or file_version != version:
+            raise ValueError("%s is not a version %d binding file" % (path, version))
+        self.sections = {}
+        for i in range(section_count):
+            name, kind, offset, count = section_format.unpack_from(self.data,
+                header_format.size + i * section_format.size)
+            if kind == INDEX:
+                section = Index(self, offset, count)
+            elif kind == ARRAY:
+                section = Array(self, offset, count)
+            else:
+                section = Value(self, offset)
+            self.sections[self.string(name)] = section
+
+    def __getitem__(self, name):
+        section = self.sections[name]
+        if isinstance(section, Value):
+            return self.value(section.offset)
+        return section
+
+    def __contains__(self, name):
+        return name in self.sections
+
+    def close(self):
+        self.data.close()
+
+    def string(self, offset):
+        offset += self.strings_base
+        length, = u32.unpack_from(self.data, offset)
+        return self.data[offset+4:offset+4+length]
+
+    def value(self, offset):
+        return self.decode(self.values_base + offset)[0]
+
+    def decode(self, offset):
+        data = self.data
+        tag = data[offset]
+        offset += 1
+        if tag == 'i':
+            return i64.unpack_from(data, offset)[0], offset + 8
+        if tag == 's':
+            return self.string(u32.unpack_from(data, offset)[0]), offset + 4
+        if tag == 'm':
+            count, = u32.unpack_from(data, offset)
+            offset += 4
+            result = {}
+            for i in range(count):
+                name = self.string(u32.unpack_from(data, offset)[0])
+                result[name], offset = self.decode(offset + 4)
+            return result, offset
+        if tag == 'l':
+            count, = u32.unpack_from(data, offset)
+            offset += 4
+            result = []
+            for i in range(count):
+                item, offset = self.decode(offset)
+                result.append(item)
+            return result, offset
+        if tag == 'N':
+            return None, offset
+        if tag == 'T':
+            return True, offset
+        if tag == 'F':
+            return False, offset
+        if tag == 'u':
+            return u64.unpack_from(data, offset)[0], offset + 8
+        if tag == 'd':
+            return f64.unpack_from(data, offset)[0], offset + 8
+        raise ValueError("bad tag %r at %d" % (tag, offset - 1))
+
+class Index(object):
+    def __init__(self, reader, offset, count):
+        self.reader = reader
+        self.offset = offset
+        self.count = count
+
+    def find(self, name):
+        "The value offset for the name, or None."
+        if isinstance(name, unicode):
+            name = name.encode('utf-8')
+        data = self.reader.data
+        digest = name_hash(name)
+        mask = self.count - 1
+        i = digest & mask
+        while True:
+            slot_hash, string, value = slot_format.unpack_from(data,
+                self.offset + i * slot_format.size)
+            if string == empty:
+                return None
+            if slot_hash == digest and self.reader.string(string) == name:
+                return value
+            i = (i + 1) & mask
+
+    def get(self, name, default=None):
+        offset = self.find(name)
+        if offset is None:
+            return default
+        return self.reader.value(offset)
+
+    def __getitem__(self, name):
+        offset = self.find(name)
+        if offset is None:
+            raise KeyError(name)
+        return self.reader.value(offset)
+
+    def __contains__(self, name):
+        return self.find(name) is not None
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        names = []
+        for i in range(self.count):
+            slot_hash, string, value = slot_format.unpack_from(self.reader.data,
+                self.offset + i * slot_format.size)
+            if string != empty:
+                names.append(self.reader.string(string))
+        return sorted(names)
+
+class Array(object):
+    def __init__(self, reader, offset, count):
+        self.reader = reader
+        self.offset = offset
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        offset, = u32.unpack_from(self.reader.data, self.offset + i * u32.size)
+        return self.reader.value(offset)
+
+class Value(object):
+    def __init__(self, reader, offset):
+        self.reader = reader
+        self.offset = offset
+
+if __name__ == '__main__':
+    import json, sys
+    if len(sys.argv) != 3:
+        sys.stderr.write("usage: python binding_file.py bindings.json bindings.bin\n")
+        sys.exit(1)
+    with open(sys.argv[1]) as fd:
+        dump(json.load(fd), sys.argv[2])
@@ -0,0 +1,156 @@
+import struct
+
+# Builds the struct module format strings of typespecs, which are PEP 3118
+# buffer formats as well. They use the standard sizes, little endian, with
+# the padding spelled out as "x", so one struct.Struct decodes a record
+# the way gcc lays it out. Nested structs and arrays are flattened into
+# the format of the record that holds them. Arrays of chars become strings.
+# The storage of bitfields, unions inside a struct and the types without a
+# struct code, like long double, become raw bytes.
+
+integer_codes = {1: 'b', 2: 'h', 4: 'i', 8: 'q'}
+float_codes = {4: 'f', 8: 'd'}
+
+signed_types = ['sbyte', 'short', 'int', 'long', 'llong', 'i8', 'i16', 'i32', 'i64']
+unsigned_types = ['ubyte', 'ushort', 'uint', 'ulong', 'ullong', 'size_t']
+
+class FormatError(Exception):
+    pass
+
+class Formats(object):
+    def __init__(self, types, abi):
+        self.types = types # The named typespecs, as in Translator.types.
+        self.abi = abi
+
+    def struct(self, spec):
+        return '<' + self.body(spec)
+
+    def union(self, spec):
+        "The format of every member of a union, padded to the size of the union."
+        formats = []
+        for name, field in spec['fields']:
+            field = self.resolve(field)
+            if is_bitfield(field):
+                code = bytes_code(round_up(field['width'], 8) // 8)
+            else:
+                code = self.body(field)
+            formats.append('<' + code + padding(spec['size'] - calcsize(code)))
+        return formats
+
+    def array(self, spec):
+        return '<' + self.body(spec)
+
+    def resolve(self, typespec):
+        while isinstance(typespec, basestring) and typespec in self.types:
+            typespec = self.types[typespec]
+        return typespec
+
+    def body(self, typespec):
+        "The format of the typespec, without the byte order."
+        typespec = self.resolve(typespec)
+        if isinstance(typespec, basestring):
+            if typespec.endswith('*'):
+                return integer_codes[self.abi['*'][0]].upper()
+            return self.primitive(typespec)
+        which = typespec['type']
+        if which == 'pointer':
+            return integer_codes[self.abi['*'][0]].upper()
+        if which == 'array':
+            shape = []
+            while isinstance(typespec, dict) and typespec['type'] == 'array':
+                length = typespec['length']
+                if length is None: # A flexible array member.
+                    length = 0
+                if not isinstance(length, (int, long)):
+                    raise FormatError("no fixed length: {!r}".format(length))
+                shape.append(length)
+                typespec = self.resolve(typespec['ctype'])
+            if typespec in ('ubyte', 'sbyte'):
+                return repeat(bytes_code(shape.pop()), product(shape))
+            return repeat(self.body(typespec), product(shape))
+        if which == 'struct':
+            return self.struct_body(typespec)
+        if which == 'union':
+            if 'size' not in typespec:
+                raise FormatError("no layout for the union")
+            return bytes_code(typespec['size'])
+        raise FormatError("no format for {!r}".format(typespec))
+
+    def primitive(self, name):
+        if name not in self.abi:
+            raise FormatError("no format for {}".format(name))
+        size = self.abi[name][0]
+        if name == 'bool':
+            return '?'
+        if name in signed_types:
+            return integer_codes[size]
+        if name in unsigned_types:
+            return integer_codes[size].upper()
+        if name in ('float', 'double'):
+            return float_codes[size]
+        return bytes_code(size)
+
+    def struct_body(self, spec):
+        if 'offsets' not in spec:
+            raise FormatError("no layout for the struct")
+        codes = []
+        end = 0
+        bits = None # Where the bytes of the last bitfields start.
+        for (name, field), offset, shift in zip(spec['fields'], spec['offsets'],
+                spec.get('shifts', [None] * len(spec['fields']))):
+            field = self.resolve(field)
+            if is_bitfield(field):
+                # The bytes the bits are in. A storage unit may start
+                # under the fields before, so its offset isn't used.
+                first = max(end, offset + shift // 8)
+                if bits is None or first > end:
+                    if bits is not None:
+                        codes.append(bytes_code(end - bits))
+                    codes.append(padding(first - end))
+                    bits = end = first
+                end = max(end, offset + round_up(shift + field['width'], 8) // 8)
+                continue
+            if bits is not None:
+                codes.append(bytes_code(end - bits))
+                bits = None
+            if offset < end:
+                raise FormatError("overlapping fields in the struct")
+            code = self.body(field)
+            codes.append(padding(offset - end) + code)
+            end = offset + calcsize(code)
+        if bits is not None:
+            codes.append(bytes_code(end - bits))
+        codes.append(padding(spec['size'] - end))
+        return ''.join(codes)
+
+def is_bitfield(typespec):
+    return isinstance(typespec, dict) and typespec['type'] == 'bitfield'
+
+def calcsize(code):
+    return struct.calcsize('<' + code)
+
+def padding(size):
+    if size <= 0:
+        return ''
+    if size == 1:
+        return 'x'
+    return '{}x'.format(size)
+
+def bytes_code(size):
+    if size == 0:
+        return ''
+    return '{}s'.format(size)
+
+def repeat(code, count):
+    if len(code) == 1:
+        return '{}{}'.format(count, code) if count != 1 else code
+    return code * count
+
+def product(values):
+    result = 1
+    for value in values:
+        result *= value
+    return result
+
+def round_up(value, align):
+    return (value + align - 1) // align * align
@@ -0,0 +1,278 @@
+import parser
+
+# Writes the translated declarations as a cffi cdef, along with a build
+# script that compiles them in API mode against the original headers.
+#
+# The Translator and the variables pick what goes into the cdef: the types
+# in translate.types, by the typedefs in translate.renamings and the struct
+# tags in translate.shadow_types, and the variables by their C names. The
+# declarations are spelled from the parsed declarators though, since the
+# typespecs don't keep the char or the const that the compiler checks the
+# cdef against. The struct, union and enum tags are declared up front, so
+# they may point to each other, and the fields of the structs and unions
+# come after the rest, once every typedef they use has been defined. The
+# typedefs are defined before their first use. Constants are left for cffi
+# to read from the headers.
+
+c_keywords = ['void', 'char', 'short', 'int', 'long', 'float', 'double', 'signed', 'unsigned']
+
+c_qualifiers = ['const', 'volatile']
+
+mode_types = {
+    '__QI__': "char",
+    '__HI__': "short",
+    '__SI__': "int",
+    '__DI__': "long long",
+    '__SF__': "float",
+    '__DF__': "double",
+}
+
+class EmitError(Exception):
+    pass
+
+class CdefEmitter(object):
+    def __init__(self, translate):
+        self.translate = translate
+        self.env = translate.env
+        self.forward = []
+        self.lines = []
+        self.defined = set() # The typedef names and the tags declared so far.
+        self.bodies = [] # The fields of the tagged structs and unions, to come last.
+        self.failed = {} # The typedef names and tags that couldn't be declared, with the error.
+        self.skipped = [] # The (name, reason) of declarations cffi couldn't take.
+
+    def cdef(self, variables, constants=()):
+        """The cdef of the types, the variables as produced by the lib*.py
+        scripts, and the constants, given by their C names."""
+        for cname, name in sorted(self.translate.renamings.iteritems()):
+            if name in self.translate.types:
+                self.declaration(cname, lambda: self.define_typedef(cname))
+        for tag, spec in sorted(self.translate.shadow_types.iteritems()):
+            space = self.env.structs if spec['type'] == 'struct' else self.env.unions
+            self.record_name(space[tag])
+        for name in sorted(variables):
+            cname = variables[name]['name']
+            self.declaration(cname, lambda: self.declare_variable(self.env.names[cname]))
+        self.lines.extend(self.bodies)
+        for cname in sorted(constants):
+            value = self.env.constants.get(cname)
+            if isinstance(value, (int, long)):
+                self.lines.append('#define {} ...'.format(cname))
+            elif isinstance(value, str):
+                self.lines.append('static char *const {};'.format(cname))
+        for name, reason in self.skipped:
+            self.lines.append('/* skipped {}: {} */'.format(name, reason))
+        return '\n'.join(self.forward + self.lines) + '\n'
+
+    def declare_variable(self, declarator):
+        declaration = self.declare(declarator, declarator.name) + ';'
+        if len(declarator) > 0 and declarator[0][0] == 'function':
+            return declaration
+        return 'extern ' + declaration
+
+    def declaration(self, name, emit):
+        "Emits a declaration, or notes why it's skipped."
+        try:
+            line = emit()
+        except EmitError as error:
+            self.skipped.append((name, error))
+        else:
+            if line is not None:
+                self.lines.append(line)
+
+    def define_typedef(self, cname):
+        if cname in self.failed:
+            raise self.failed[cname]
+        if cname in self.defined:
+            return
+        self.defined.add(cname)
+        typedecl = self.env.types[cname]
+        try:
+            if len(typedecl) == 0 and is_anonymous_enum(typedecl):
+                self.lines.append('typedef int... {};'.format(cname))
+            else:
+                self.lines.append('typedef {};'.format(self.spell(typedecl, cname, '\n')))
+        except EmitError as error:
+            self.failed[cname] = error
+            raise
+
+    def record_name(self, record, separator=' '):
+        if record.name is None:
+            return '{} {}'.format(record.which, self.record_body(record, separator))
+        name = '{} {}'.format(record.which, record.name)
+        if name not in self.defined:
+            self.defined.add(name)
+            self.forward.append(name + ';')
+            if has_fields(self.translate, record):
+                try:
+                    self.bodies.append('{} {};'.format(name, self.record_body(record, '\n')))
+                except EmitError as error:
+                    self.failed[name] = error
+                    self.skipped.append((name, error))
+        return name
+
+    def record_body(self, record, separator):
+        fields = [self.declare(field, field.name or '') + ';' for field in record.fields]
+        if separator == '\n':
+            # Lets cffi take the layout from the compiler, packed or not.
+            # It doesn't allow that with bitfields.
+            if not any(is_bitfield(field) for field in record.fields):
+                fields.append('...;')
+            return '{\n' + ''.join('    {}\n'.format(field) for field in fields) + '}'
+        return '{ ' + ' '.join(fields) + ' }'
+
+    def enum_name(self, enum):
+        if enum.name is None:
+            return 'enum { ... }'
+        name = 'enum ' + enum.name
+        if name not in self.defined:
+            self.defined.add(name)
+            self.forward.append(name + ' { ... };')
+        return name
+
+    def type_name(self, name):
+        if self.translate.dependency(name) is not None:
+            return name # Declared by the build script of the dependency.
+        if name not in self.env.types:
+            raise EmitError("{} is not defined".format(name))
+        if self.env.types[name] == 'va_list':
+            raise EmitError("{} is a va_list".format(name))
+        if isinstance(self.env.types[name], parser.Declarator):
+            self.define_typedef(name)
+        return name
+
+    def base_type(self, declarator, separator):
+        words = [qualifier for qualifier in c_qualifiers if qualifier in declarator.qualifiers]
+        mode = mode_attribute(declarator)
+        if mode is not None:
+            signed = 'unsigned' if 'unsigned' in declarator.specifiers else 'signed'
+            words.append(mode_types[mode] if mode in ('__SF__', '__DF__') else signed + ' ' + mode_types[mode])
+            return ' '.join(words)
+        for specifier in declarator.specifiers:
+            if isinstance(specifier, (parser.Structure, parser.Union)):
+                words.append(self.record_name(specifier, separator))
+            elif isinstance(specifier, parser.Enum):
+                words.append(self.enum_name(specifier))
+            elif specifier == '__signed__':
+                words.append('signed')
+            elif specifier in c_keywords:
+                words.append(specifier)
+            else:
+                words.append(self.type_name(specifier))
+        return ' '.join(words)
+
+    def declare(self, declarator, name=''):
+        "The C declaration of a name, as the declarator spells it."
+        declaration = self.spell(declarator, name, ' ')
+        self.check_value(declarator)
+        return declaration
+
+    def spell(self, declarator, name, separator):
+        text = name
+        for which, params in declarator:
+            if which == 'pointer':
+                qualifiers = [qualifier for qualifier in c_qualifiers if qualifier in params]
+                text = '*' + ' '.join(qualifiers + [text]).strip()
+            elif which == 'array':
+                text = '{}[{}]'.format(parenthesize(text), self.length(params))
+            elif which == 'function':
+                text = '{}({})'.format(parenthesize(text), self.parameters(params))
+            elif which == 'bitfield':
+                width = self.translate.constant(params)
+                if not isinstance(width, (int, long)):
+                    raise EmitError("cannot compute the width of {}".format(name))
+                text = '{} : {}'.format(text, width).strip()
+        return join(self.base_type(declarator, separator), text)
+
+    def parameters(self, params):
+        declarations = []
+        for param in params or ():
+            if param is Ellipsis:
+                declarations.append('...')
+            else:
+                declarations.append(self.declare(param))
+        return ', '.join(declarations) or 'void'
+
+    def length(self, params):
+        length = self.translate.constant(params)
+        if length is None:
+            return ''
+        if isinstance(length, (int, long)):
+            return length
+        return '...'
+
+    def check_value(self, declarator):
+        "Refuses a struct or union held by value, if its fields aren't declared."
+        if len(declarator) > 0 and declarator[-1][0] == 'pointer':
+            return
+        if len(declarator.specifiers) != 1:
+            return
+        specifier = declarator.specifiers[0]
+        if isinstance(specifier, (parser.Structure, parser.Union)) and specifier.name is not None:
+            name = '{} {}'.format(specifier.which, specifier.name)
+            if name in self.failed:
+                raise self.failed[name]
+            if not has_fields(self.translate, specifier):
+                raise EmitError("{} is opaque, but used by value".format(name))
+        elif isinstance(self.env.types.get(specifier), parser.Declarator):
+            self.check_value(self.env.types[specifier])
+
+def has_fields(translate, record):
+    return record.fields is not None and record.name not in translate.blacklist
+
+def is_anonymous_enum(declarator):
+    specifiers = declarator.specifiers
+    return len(specifiers) == 1 and isinstance(specifiers[0], parser.Enum) and specifiers[0].name is None
+
+def is_bitfield(declarator):
+    return any(which == 'bitfield' for which, params in declarator)
+
+def mode_attribute(declarator):
+    "The machine mode given by __attribute__((__mode__(...))), if any."
+    for which, params in declarator.attributes:
+        if which == 'attribute':
+            for cell in params:
+                if isinstance(cell, list) and cell[0] == '__mode__':
+                    return cell[1]
+
+def parenthesize(declarator):
+    if declarator.startswith('*'):
+        return '(' + declarator + ')'
+    return declarator
+
+def join(base, declarator):
+    if declarator == '':
+        return base
+    return base + ' ' + declarator
+
+build_template = '''\
+# Generated by cffi_emitter.py, compiles the {module} extension module.
+from cffi import FFI
+{imports}
+ffibuilder = FFI()
+{includes}ffibuilder.cdef("""
+{cdef}""")
+ffibuilder.set_source({module!r}, """
+{source}""", libraries={libraries!r})
+
+if __name__ == "__main__":
+    ffibuilder.compile(verbose=True)
+'''
+
+def build_script(module, cdef, headers, libraries, depends=()):
+    """A build script for an out-of-line API mode module. The build scripts
+    of the dependencies are imported by the name {module}_build, with the
+    module named as the dependency with an underscore prefix."""
+    return build_template.format(
+        module=module,
+        cdef=cdef,
+        imports=''.join('from _{0}_build import ffibuilder as {0}_ffibuilder\n'.format(name)
+            for name in depends),
+        includes=''.join('ffibuilder.include({}_ffibuilder)\n'.format(name) for name in depends),
+        source=''.join('#include "{}"\n'.format(header) for header in headers),
+        libraries=list(libraries))
+
+def write_build_script(path, module, translate, variables, constants, headers, libraries, depends=()):
+    cdef = CdefEmitter(translate).cdef(variables, constants)
+    with open(path, 'w') as fd:
+        fd.write(build_script(module, cdef, headers, libraries, depends))
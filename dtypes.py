@@ -0,0 +1,145 @@
+# Describes the structs and unions of the Translator as NumPy structured
+# dtypes, so that an array of them in C memory can be wrapped with
+# np.frombuffer. A description is the dict np.dtype takes:
+#
+#   {"names": [...], "formats": [...], "offsets": [...], "itemsize": n}
+#
+# The offsets and the itemsize come from the computed layouts, so NumPy
+# doesn't have to guess the padding. A format is a typestring like "<i4",
+# the description of a nested struct, or a (format, shape) pair for an
+# array. Pointers are unsigned integers of the pointer size. The fields of
+# anonymous structs and unions are lifted into the record that holds them,
+# as C does. Bitfields are left out, their bytes stay inside the itemsize.
+
+primitive_kinds = {
+    'bool':    'b',
+    'ubyte':   'u',
+    'sbyte':   'i',
+    'short':   'i',
+    'ushort':  'u',
+    'int':     'i',
+    'uint':    'u',
+    'long':    'i',
+    'ulong':   'u',
+    'llong':   'i',
+    'ullong':  'u',
+    'float':   'f',
+    'double':  'f',
+    'ldouble': 'f',
+    'i8':      'i',
+    'i16':     'i',
+    'i32':     'i',
+    'i64':     'i',
+    'size_t':  'u',
+    'va_list': 'V',
+}
+
+class DtypeError(Exception):
+    pass
+
+class DtypeEmitter(object):
+    def __init__(self, translate):
+        self.translate = translate
+        self.abi = translate.layout.abi
+        self.descriptions = {}
+        self.skipped = [] # The (name, reason) of the records without a dtype.
+
+    def describe_types(self):
+        "The descriptions of every struct and union in translate.types, by name."
+        result = {}
+        for name in sorted(self.translate.types):
+            spec = self.resolve(name)
+            if not isinstance(spec, dict) or spec['type'] not in ('struct', 'union'):
+                continue
+            try:
+                result[name] = self.record(spec)
+            except DtypeError as error:
+                self.skipped.append((name, error))
+        return result
+
+    def resolve(self, typespec):
+        "Follows the type names to the typespec they stand for."
+        while isinstance(typespec, basestring) and typespec in self.translate.types:
+            typespec = self.translate.types[typespec]
+        return typespec
+
+    def record(self, spec):
+        if id(spec) in self.descriptions:
+            return self.descriptions[id(spec)]
+        if 'offsets' not in spec:
+            raise DtypeError("no layout for the {}".format(spec['type']))
+        names = []
+        formats = []
+        offsets = []
+        for (name, field), offset in zip(spec['fields'], spec['offsets']):
+            field = self.resolve(field)
+            if isinstance(field, dict) and field['type'] == 'bitfield':
+                continue
+            if name is None:
+                if not isinstance(field, dict) or field['type'] not in ('struct', 'union'):
+                    continue
+                inner = self.record(field)
+                names.extend(inner['names'])
+                formats.extend(inner['formats'])
+                offsets.extend(offset + inner_offset for inner_offset in inner['offsets'])
+                continue
+            names.append(name)
+            formats.append(self.format(field))
+            offsets.append(offset)
+        description = {
+            'names': names,
+            'formats': formats,
+            'offsets': offsets,
+            'itemsize': spec['size']}
+        self.descriptions[id(spec)] = description
+        return description
+
+    def format(self, typespec):
+        typespec = self.resolve(typespec)
+        if isinstance(typespec, basestring):
+            if typespec.endswith('*'):
+                return typestring('u', self.abi['*'][0])
+            if typespec in primitive_kinds:
+                return typestring(primitive_kinds[typespec], self.abi[typespec][0])
+            raise DtypeError("no dtype for {}".format(typespec))
+        which = typespec['type']
+        if which == 'pointer':
+            return typestring('u', self.abi['*'][0])
+        if which == 'array':
+            shape = []
+            while isinstance(typespec, dict) and typespec['type'] == 'array':
+                length = typespec['length']
+                if length is None: # A flexible array member.
+                    length = 0
+                if not isinstance(length, (int, long)):
+                    raise DtypeError("unresolved array length: {!r}".format(length))
+                shape.append(length)
+                typespec = self.resolve(typespec['ctype'])
+            return (self.format(typespec), tuple(shape))
+        if which in ('struct', 'union'):
+            return self.record(typespec)
+        raise DtypeError("no dtype for {!r}".format(typespec))
+
+def typestring(kind, size):
+    if size == 1 or kind == 'V':
+        return '|{}{}'.format(kind, size)
+    return '<{}{}'.format(kind, size)
+
+def describe_types(translate):
+    return DtypeEmitter(translate).describe_types()
+
+def numpy_dtype(description):
+    """The np.dtype of a description, also one read back from json, where
+    the (format, shape) pairs of the arrays turned into lists."""
+    import numpy
+    return numpy.dtype(rebuild(description), align=False)
+
+def rebuild(description):
+    if isinstance(description, dict):
+        result = dict(description)
+        result['names'] = [str(name) for name in description['names']]
+        result['formats'] = [rebuild(format) for format in description['formats']]
+        return result
+    if isinstance(description, (list, tuple)):
+        return (rebuild(description[0]), tuple(description[1]))
+    return str(description)
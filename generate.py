@@ -0,0 +1,96 @@
+import parser, re, json, os
+import binding_file, cffi_emitter, dtypes, reachability
+from translator import Translator, TypeTable
+
+# The pipeline of the lib*.py scripts: parses the headers, translates the
+# selected functions, variables and constants, and prints the bindings as
+# json. A script gives the renamings of its names,
+# which return None for the names that don't belong to the library. The
+# macros evaluated are the constants the library keeps.
+#
+# The environment variables turn on the rest:
+#
+#   CFFI_GEN_FORMATS       adds the struct module formats to the types.
+#   CFFI_GEN_INTERN        interns the typespecs into a shared table, which
+#                          the types and variables refer to by id.
+#   CFFI_GEN_ROOTS         only outputs what these names reach, separated by commas.
+#   CFFI_GEN_PRUNED        writes the names the roots don't reach into this file.
+#   CFFI_GEN_BUILD_SCRIPT  writes a cffi build script here, if the script
+#                          gives the libraries to link with.
+#   CFFI_GEN_DTYPES        adds the NumPy dtypes of the structs and unions.
+#   CFFI_GEN_BINARY        writes a binding file here, instead of the json.
+
+def generate(name, headers, rename_type, rename_constant, rename_variable,
+        dependency=(lambda name: None), extra_flags=(), blacklist=(), bluelist={},
+        extra_types=None, libraries=None, depends=(), comment=None):
+    env = parser.default_env()
+    parser.parse(env, headers, extra_flags=extra_flags,
+        select_macros=lambda cname: rename_constant(cname) is not None)
+    translate = Translator(env, rename_type, dependency)
+    translate.buffer_formats = 'CFFI_GEN_FORMATS' in os.environ
+    translate.blacklist.update(blacklist)
+    translate.bluelist.update(bluelist)
+
+    closure = None
+    reachable = lambda cname: True
+    if 'CFFI_GEN_ROOTS' in os.environ:
+        closure = reachability.Closure(translate, os.environ['CFFI_GEN_ROOTS'].split(','))
+        reachable = closure.reachable
+        if 'CFFI_GEN_PRUNED' in os.environ:
+            closure.write_report(os.environ['CFFI_GEN_PRUNED'])
+
+    constants = {}
+    for cname, value in env.constants.iteritems():
+        if rename_constant(cname) is not None and reachable(cname):
+            if isinstance(value, (int, str)):
+                constants[rename_constant(cname)] = value
+
+    # The types a library wants even if no function refers to them. With the
+    # roots given, they're in the output only if they're reached.
+    if extra_types is not None and closure is None:
+        for cname in env.types:
+            if extra_types(cname):
+                translate.visit_type(cname)
+
+    variables = {}
+    for cname in env.names:
+        if rename_variable(cname) is not None and reachable(cname):
+            typespec = translate.declarator(env.names[cname])
+            variables[rename_variable(cname)] = {'name':cname, 'type':typespec}
+
+    if libraries is not None and 'CFFI_GEN_BUILD_SCRIPT' in os.environ:
+        cffi_emitter.write_build_script(os.environ['CFFI_GEN_BUILD_SCRIPT'], '_' + name,
+            translate, variables,
+            [cname for cname in env.constants if rename_constant(cname) is not None and reachable(cname)],
+            headers, libraries, depends)
+
+    bindings = {
+        'constants': constants,
+        'types': translate.types if closure is None else closure.types,
+        'variables': variables}
+    if 'CFFI_GEN_INTERN' in os.environ:
+        typespecs = TypeTable()
+        bindings['types'] = typespecs.intern_names(bindings['types'])
+        for key in sorted(variables):
+            variables[key]['type'] = typespecs.intern(variables[key]['type'])
+        bindings['typespecs'] = typespecs.entries
+    if comment is not None:
+        bindings['comment'] = comment
+    if len(depends) > 0:
+        bindings['depends'] = list(depends)
+
+    if 'CFFI_GEN_DTYPES' in os.environ:
+        bindings['dtypes'] = dtypes.describe_types(translate)
+
+    if 'CFFI_GEN_BINARY' in os.environ:
+        binding_file.dump(bindings, os.environ['CFFI_GEN_BINARY'])
+    else:
+        print json.dumps(bindings, indent=2, sort_keys=True)
+
+def strip_prefix(*prefixes):
+    "Renames the names that start with one of the prefixes by removing it."
+    def rename(name):
+        for prefix in prefixes:
+            if re.match(re.escape(prefix) + r'\w', name):
+                return name[len(prefix):]
+    return rename
@@ -0,0 +1,124 @@
+import os
+import py_compile
+from lrkit import Rule, Accept
+
+# Turns the LR(1) tables produced by lrkit into flat integer arrays.
+#
+# Terminals and nonterminals are numbered, and every state has one row
+# of `width` cells in `action` and one row of `goto_width` cells in `goto`.
+# An action cell is 0 on error, state+1 on shift, ~rule_index on reduce,
+# and ~len(rules) on accept. Cells that the lrkit table leaves empty are
+# filled with the '*' action, so the parser needs a single lookup per
+# token. Token groups that the grammar doesn't mention are looked up
+# from the '*' column.
+#
+# The body_states mark the states where a '{' opens a compound_statement,
+# which the parser skips over without running it through the table.
+
+class DenseTable(object):
+    def __init__(self, terminals, nonterminals, reductions, action, goto, type_names):
+        self.terminals = terminals
+        self.nonterminals = nonterminals
+        self.reductions = reductions
+        self.action = action
+        self.goto = goto
+        self.type_names = type_names
+        self.terminal_index = dict((name, i) for i, name in enumerate(terminals))
+        self.wildcard = self.terminal_index['*']
+        self.type_name = self.terminal_index['TYPE_NAME']
+        self.width = len(terminals)
+        self.goto_width = len(nonterminals)
+        self.accept = len(reductions)
+        self.left_brace = self.terminal_index['LEFT_BRACE']
+        self.compound_statement = nonterminals.index('compound_statement')
+        self.body_states = tuple(
+            goto[state*self.goto_width + self.compound_statement] >= 0 and
+            action[state*self.width + self.left_brace] > 0
+            for state in range(len(type_names)))
+        self.funcs = None
+
+    def bind(self, rules):
+        self.funcs = [rule.func for rule in rules]
+        return self
+
+    def expected(self, state):
+        row = self.action[state*self.width:(state+1)*self.width]
+        return [self.terminals[i] for i, action in enumerate(row) if action != 0]
+
+    def dump(self):
+        return (self.action, self.goto, self.type_names)
+
+def compile_tables(rules, grammar, tables):
+    nonterminals = sorted(set(lhs for lhs, rhs in grammar))
+    terminals = set(['*'])
+    for lhs, rhs in grammar:
+        terminals.update(name for name in rhs if name not in nonterminals)
+    terminals = [None] + sorted(terminals)
+    nonterminal_index = dict((name, i) for i, name in enumerate(nonterminals))
+    reductions = tuple((len(rhs), nonterminal_index[lhs]) for lhs, rhs in grammar)
+    return [compile_table(rules, terminals, nonterminals, reductions, table)
+        for table in tables]
+
+def compile_table(rules, terminals, nonterminals, reductions, table):
+    rule_index = dict((id(rule), i) for i, rule in enumerate(rules))
+    terminal_index = dict((name, i) for i, name in enumerate(terminals))
+    nonterminal_index = dict((name, i) for i, name in enumerate(nonterminals))
+    def encode(action):
+        if action is None:
+            return 0
+        if isinstance(action, Rule):
+            return ~rule_index[id(action)]
+        if isinstance(action, Accept):
+            return ~len(rules)
+        return action + 1
+
+    action = []
+    goto = []
+    type_names = []
+    for row in table.table:
+        cells = [encode(row.get('*'))] * len(terminals)
+        gotos = [-1] * len(nonterminals)
+        for name, act in row.iteritems():
+            if name in nonterminal_index:
+                gotos[nonterminal_index[name]] = act
+            else:
+                cells[terminal_index[name]] = encode(act)
+        action.extend(cells)
+        goto.extend(gotos)
+        type_names.append('TYPE_NAME' in row)
+    return DenseTable(terminals, nonterminals, reductions,
+        tuple(action), tuple(goto), tuple(type_names))
+
+def load_tables(data):
+    terminals, nonterminals, reductions, tables = data
+    return [DenseTable(terminals, nonterminals, reductions, *table)
+        for table in tables]
+
+def dump_tables(tables):
+    first = tables[0]
+    return (first.terminals, first.nonterminals, first.reductions,
+        [table.dump() for table in tables])
+
+def write_module(path, digest, names, tables):
+    terminals, nonterminals, reductions, dumped = dump_tables(tables)
+    with open(path, 'w') as fd:
+        fd.write('# Generated by grammar_compiler.py from the rules in parser.py, do not edit.\n')
+        fd.write('digest = {!r}\n'.format(digest))
+        fd.write('terminals = {!r}\n'.format(terminals))
+        fd.write('nonterminals = {!r}\n'.format(nonterminals))
+        fd.write('reductions = {!r}\n'.format(reductions))
+        fd.write('tables = {\n')
+        for name, table in zip(names, dumped):
+            fd.write('    {!r}: {!r},\n'.format(name, table))
+        fd.write('}\n')
+
+def load_module(module, names):
+    return load_tables((module.terminals, module.nonterminals,
+        module.reductions, [module.tables[name] for name in names]))
+
+if __name__ == '__main__':
+    import parser
+    path = os.path.join(os.path.dirname(os.path.abspath(parser.__file__)), 'parser_tables.py')
+    write_module(path, parser.grammar_digest(), parser.table_names,
+        [parser.translation_unit, parser.macro_expression])
+    py_compile.compile(path)
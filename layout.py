@@ -0,0 +1,278 @@
+import parser
+import platform
+import translator
+
+# Computes the sizes, alignments and field offsets of C types as gcc lays
+# them out on the System V ABI for x86-64 and i386. The sizes are given
+# in bytes, and keyed by the primitive names the Translator produces.
+# Inside structures, i386 aligns double, long long and long double only
+# to 4 bytes.
+
+x86_64 = {
+    'void':    (1, 1),
+    'bool':    (1, 1),
+    'ubyte':   (1, 1),
+    'sbyte':   (1, 1),
+    'short':   (2, 2),
+    'ushort':  (2, 2),
+    'int':     (4, 4),
+    'uint':    (4, 4),
+    'long':    (8, 8),
+    'ulong':   (8, 8),
+    'llong':   (8, 8),
+    'ullong':  (8, 8),
+    'float':   (4, 4),
+    'double':  (8, 8),
+    'ldouble': (16, 16),
+    'i8':      (1, 1),
+    'i16':     (2, 2),
+    'i32':     (4, 4),
+    'i64':     (8, 8),
+    'size_t':  (8, 8),
+    'va_list': (24, 8),
+    '*':       (8, 8),
+}
+
+i386 = dict(x86_64)
+i386.update({
+    'long':    (4, 4),
+    'ulong':   (4, 4),
+    'llong':   (8, 4),
+    'ullong':  (8, 4),
+    'double':  (8, 4),
+    'ldouble': (12, 4),
+    'i64':     (8, 4),
+    'size_t':  (4, 4),
+    'va_list': (4, 4),
+    '*':       (4, 4),
+})
+
+abis = {'x86_64': x86_64, 'i386': i386}
+
+# __attribute__((aligned)) without an argument.
+biggest_alignment = 16
+
+def default_abi():
+    if platform.machine() in ('i386', 'i486', 'i586', 'i686'):
+        return 'i386'
+    return 'x86_64'
+
+def abi_for_flags(flags, abi):
+    for flag in flags:
+        if flag == '-m32':
+            abi = 'i386'
+        elif flag == '-m64':
+            abi = 'x86_64'
+    return abi
+
+class LayoutError(Exception):
+    pass
+
+class RecordLayout(object):
+    def __init__(self, size, align, offsets, shifts):
+        self.size = size
+        self.align = align
+        self.offsets = offsets # In bytes, for every field.
+        self.shifts = shifts   # In bits from the offset, None if not a bitfield.
+
+class Layout(object):
+    def __init__(self, env, abi=None):
+        self.env = env
+        self.abi = abis[env.abi if abi is None else abi]
+        self.records = {}
+        self.typenames = {}
+        self.resolver = None
+
+    def sizeof(self, typesign):
+        "Size of the type in a sizeof(...) expression."
+        specifier = typesign[0]
+        if len(typesign) > 1 and len(typesign[1]) > 0:
+            return self.abi['*'][0]
+        return self.specifiers(specifier)[0]
+
+    def declarator(self, declarator):
+        "The (size, align) of the type of a declarator."
+        modifiers = [(which, params) for which, params in reversed(declarator.stack)
+            if which != 'bitfield']
+        if len(modifiers) > 0 and modifiers[0][0] in ('pointer', 'function'):
+            size = align = None # The base type may be incomplete.
+        else:
+            size, align = self.specifiers(declarator)
+            for name, args in attribute_items(declarator.attributes):
+                if name == 'mode' and len(args) > 0:
+                    mode = '__{}__'.format(args[0].strip('_'))
+                    size, align = self.primitive(translator.gcc_primitive_types.get(mode))
+        for which, params in modifiers:
+            if which == 'pointer':
+                size, align = self.abi['*']
+            elif which == 'function':
+                size, align = 1, 1
+            elif which == 'array':
+                size *= 0 if params is None else self.constant(params)
+            else:
+                raise LayoutError("no layout for %r" % declarator)
+        return size, align
+
+    def specifiers(self, declarator):
+        name = translator.primitive_type(declarator)
+        if name is not None:
+            return self.primitive(name)
+        if len(declarator.specifiers) == 1:
+            specifier = declarator.specifiers[0]
+            if isinstance(specifier, (parser.Structure, parser.Union)):
+                record = self.record(specifier)
+                return record.size, record.align
+            if isinstance(specifier, parser.Enum):
+                return self.primitive('int')
+            if isinstance(specifier, str):
+                return self.typename(specifier)
+        raise LayoutError("no layout for %r" % declarator.specifiers)
+
+    def primitive(self, name):
+        if name not in self.abi:
+            raise LayoutError("no layout for %s" % name)
+        return self.abi[name]
+
+    def typename(self, name):
+        if name not in self.typenames:
+            typedecl = self.env.types[name]
+            if isinstance(typedecl, str):
+                self.typenames[name] = self.primitive(typedecl)
+            else:
+                size, align = self.declarator(typedecl)
+                for attribute, args in attribute_items(typedecl.attributes):
+                    if attribute == 'aligned':
+                        align = aligned(args) or align
+                self.typenames[name] = size, align
+        return self.typenames[name]
+
+    def record(self, record):
+        if record in self.records:
+            if self.records[record] is None:
+                raise LayoutError("struct %s contains itself" % record.name)
+            return self.records[record]
+        if record.fields is None:
+            raise LayoutError("%s %s is incomplete" % (record.which, record.name))
+        packed = False
+        alignment = None
+        for name, args in attribute_items(record.attributes):
+            if name == 'packed':
+                packed = True
+            elif name == 'aligned':
+                alignment = aligned(args)
+        self.records[record] = None
+        try:
+            if record.which == 'union':
+                result = self.union(record.fields, packed)
+            else:
+                result = self.struct(record.fields, packed)
+        except:
+            del self.records[record]
+            raise
+        if alignment is not None and alignment > result.align:
+            result.align = alignment
+            result.size = round_up(result.size, alignment)
+        self.records[record] = result
+        return result
+
+    def struct(self, fields, packed):
+        bit = 0
+        align = 1
+        offsets = []
+        shifts = []
+        for field in fields:
+            size, field_align = self.declarator(field)
+            field_packed, alignment = field_attributes(field)
+            width = bitfield_width(field)
+            if width is not None:
+                width = self.constant(width)
+                unit = field_align * 8
+                if width == 0:
+                    bit = round_up(bit, unit)
+                elif packed or field_packed:
+                    unit = 8
+                elif bit % unit + width > size * 8:
+                    bit = round_up(bit, unit)
+                if field.name is not None and not (packed or field_packed):
+                    align = max(align, field_align)
+                offset = bit // unit * unit // 8
+                offsets.append(offset)
+                shifts.append(bit - offset * 8)
+                bit += width
+            else:
+                if packed or field_packed:
+                    field_align = 1
+                if alignment is not None:
+                    field_align = max(field_align, alignment)
+                bit = round_up(bit, field_align * 8)
+                offsets.append(bit // 8)
+                shifts.append(None)
+                bit += size * 8
+                align = max(align, field_align)
+        return RecordLayout(round_up(round_up(bit, 8) // 8, align), align, offsets, shifts)
+
+    def union(self, fields, packed):
+        size = 0
+        align = 1
+        shifts = []
+        for field in fields:
+            field_size, field_align = self.declarator(field)
+            field_packed, alignment = field_attributes(field)
+            width = bitfield_width(field)
+            if width is not None:
+                field_size = round_up(self.constant(width), 8) // 8
+                shifts.append(0)
+            else:
+                shifts.append(None)
+            if packed or field_packed:
+                field_align = 1
+            if alignment is not None:
+                field_align = max(field_align, alignment)
+            size = max(size, field_size)
+            align = max(align, field_align)
+        return RecordLayout(round_up(size, align), align, [0] * len(fields), shifts)
+
+    def constant(self, value):
+        "Evaluates array lengths and bitfield widths."
+        if isinstance(value, parser.Unresolved):
+            if self.resolver is None:
+                self.resolver = parser.ConstantResolver(self.env, self)
+            value = self.resolver.evaluate(value)
+        if isinstance(value, (int, long)):
+            return value
+        raise LayoutError("not a constant: %r" % (value,))
+
+def bitfield_width(declarator):
+    for which, params in declarator.stack:
+        if which == 'bitfield':
+            return params
+
+def field_attributes(declarator):
+    packed = False
+    alignment = None
+    for name, args in attribute_items(declarator.attributes):
+        if name == 'packed':
+            packed = True
+        elif name == 'aligned':
+            alignment = aligned(args)
+    return packed, alignment
+
+def attribute_items(attributes):
+    "Yields the (name, args) in __attribute__ lists, names without underscores."
+    for which, params in attributes:
+        if which != 'attribute':
+            continue
+        for item in params:
+            if isinstance(item, str):
+                yield item.strip('_'), []
+            elif isinstance(item, list) and isinstance(item[0], str):
+                yield item[0].strip('_'), item[1:]
+
+def aligned(args):
+    if len(args) == 0:
+        return biggest_alignment
+    if isinstance(args[0], (int, long)):
+        return args[0]
+
+def round_up(value, align):
+    return (value + align - 1) // align * align
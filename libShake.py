@@ -1,33 +1,17 @@
-import parser, re, json, sys
-from translator import Translator, is_function
+import re, sys
+from generate import generate, strip_prefix
 
 def rename_type(name):
     return re.sub(r"^Shake_|^SHAKE_", r"", name)
 
-env = parser.default_env()
-# Pass the path to shake.h to this code as an argument.
-parser.parse(env, sys.argv[1:]) 
-translate = Translator(env, rename_type)
-
-constants = {}
-variables = {}
-
-for name, value in env.constants.iteritems():
-    if re.match(r'^SHAKE_\w', name):
-        if isinstance(value, (int, str)):
-            name = re.sub(r"^SHAKE_", r"", name)
-            constants[name] = value
+def rename_variable(cname):
+    if not re.match(r'^Shake_\w', cname):
+        return None
+    name = re.sub(r"^Shake_", r"", cname)
+    name = re.sub(r"^[A-Z][a-z]", lambda pat: pat.group(0).lower(), name)
+    if name[:1].upper() and not name[:2].upper():
+        name = name[:1].lower() + name[1:]
+    return name
 
-for cname in env.names:
-    if re.match(r'^Shake_\w', cname):
-        typespec = translate.declarator(env.names[cname])
-        name = re.sub(r"^Shake_", r"", cname)
-        name = re.sub(r"^[A-Z][a-z]", lambda pat: pat.group(0).lower(), name)
-        if name[:1].upper() and not name[:2].upper():
-            name = name[:1].lower() + name[1:]
-        variables[name] = {'name':cname, 'type':typespec}
-
-print json.dumps({
-    'constants': constants,
-    'types': translate.types,
-    'variables': variables}, indent=2, sort_keys=True)
+# Pass the path to shake.h to this code as an argument.
+generate('libShake', sys.argv[1:], rename_type, strip_prefix('SHAKE_'), rename_variable)
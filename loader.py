@@ -0,0 +1,235 @@
+import binding_file
+import ctypes
+import json
+
+# Loads the bindings of a shared library into a module-like object. Nothing
+# is built before it's used: an attribute is looked up from the variables,
+# the constants and then the types of the bindings, turned into a ctypes
+# function, value or type, and kept in the object from then on. The shared
+# library itself is opened when the first variable is accessed.
+#
+# The types named like "libSDL2.Rect" come from a dependency, which must be
+# listed in the "depends" of the bindings. The dependencies are loaded with
+# the `dependency` function, when they're first needed.
+
+primitive_types = {
+    'void':    None,
+    'bool':    ctypes.c_bool,
+    'ubyte':   ctypes.c_ubyte,
+    'sbyte':   ctypes.c_byte,
+    'short':   ctypes.c_short,
+    'ushort':  ctypes.c_ushort,
+    'int':     ctypes.c_int,
+    'uint':    ctypes.c_uint,
+    'long':    ctypes.c_long,
+    'ulong':   ctypes.c_ulong,
+    'llong':   ctypes.c_longlong,
+    'ullong':  ctypes.c_ulonglong,
+    'float':   ctypes.c_float,
+    'double':  ctypes.c_double,
+    'ldouble': ctypes.c_longdouble,
+    'i8':      ctypes.c_int8,
+    'i16':     ctypes.c_int16,
+    'i32':     ctypes.c_int32,
+    'i64':     ctypes.c_int64,
+    'size_t':  ctypes.c_size_t,
+    'va_list': ctypes.c_void_p,
+}
+
+# The char* are most often strings.
+pointer_types = {
+    'void':  ctypes.c_void_p,
+    'ubyte': ctypes.c_char_p,
+    'sbyte': ctypes.c_char_p,
+}
+
+def open_bindings(path):
+    "Reads the bindings from a json or a binding file."
+    if path.endswith('.json'):
+        with open(path) as fd:
+            return json.load(fd)
+    return binding_file.BindingFile(path)
+
+class Library(object):
+    def __init__(self, bindings, path, dependency=(lambda name: None)):
+        self._bindings = bindings
+        self._path = path
+        self._dependency = dependency
+        self._dll = None
+        self._types = {}
+        self._typespecs = {}
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        bindings = self._bindings
+        if name in bindings['variables']:
+            value = self._variable(bindings['variables'][name])
+        elif name in bindings['constants']:
+            value = bindings['constants'][name]
+        elif name in bindings['types']:
+            value = self._named_type(name)
+        else:
+            raise AttributeError(name)
+        self.__dict__[name] = value
+        return value
+
+    def _library(self):
+        if self._dll is None:
+            for name in self._depends():
+                self._dependency(name)._library()
+            self._dll = ctypes.CDLL(self._path)
+        return self._dll
+
+    def _variable(self, variable):
+        typespec = self._typespec(variable['type'])
+        if self._is_function(typespec):
+            function = self._library()[str(variable['name'])]
+            function.restype = self._ctype(typespec['restype'])
+            function.argtypes = [self._ctype(argtype) for argtype in typespec['argtypes']]
+            return function
+        return self._ctype(typespec).in_dll(self._library(), str(variable['name']))
+
+    def _typespec(self, typespec):
+        "Looks up the entry of an interned typespec."
+        if isinstance(typespec, (int, long)):
+            return self._bindings['typespecs'][typespec]
+        return typespec
+
+    def _is_function(self, typespec):
+        typespec = self._typespec(typespec)
+        if isinstance(typespec, basestring):
+            library, name = self._split_name(typespec)
+            if library is not None:
+                return library._is_function(name)
+            if name in self._bindings['types']:
+                return self._is_function(self._bindings['types'][name])
+            return False
+        return typespec['type'] == 'cfunc'
+
+    def _depends(self):
+        if 'depends' in self._bindings:
+            return list(self._bindings['depends'])
+        return []
+
+    def _split_name(self, name):
+        if '.' not in name:
+            return None, name
+        library, name = name.split('.', 1)
+        if library not in self._depends():
+            raise LookupError("%s is not a dependency of %s" % (library, self._path))
+        return self._dependency(library), name
+
+    def _ctype(self, typespec):
+        if isinstance(typespec, basestring):
+            return self._named_type(typespec)
+        if isinstance(typespec, (int, long)):
+            if typespec not in self._typespecs:
+                self._typespecs[typespec] = self._build(self._typespec(typespec))
+            return self._typespecs[typespec]
+        return self._build(typespec)
+
+    def _named_type(self, name):
+        if name not in self._types:
+            self._types[name] = self._build_named(name)
+        return self._types[name]
+
+    def _build_named(self, name):
+        if name.endswith('*'):
+            target = name[:-1]
+            if target in pointer_types:
+                return pointer_types[target]
+            if self._is_function(target):
+                return self._named_type(target)
+            return ctypes.POINTER(self._named_type(target))
+        if name in primitive_types:
+            return primitive_types[name]
+        library, name = self._split_name(name)
+        if library is not None:
+            return library._named_type(name)
+        typespec = self._typespec(self._bindings['types'][name])
+        if isinstance(typespec, basestring):
+            return self._named_type(typespec)
+        # Registered before the fields, for the structs that point to themselves.
+        if typespec['type'] in ('struct', 'union', 'opaque'):
+            return self._record(typespec, name)
+        return self._build(typespec)
+
+    def _build(self, typespec):
+        which = typespec['type']
+        if which == 'pointer':
+            if self._is_function(typespec['to']):
+                return self._ctype(typespec['to'])
+            return ctypes.POINTER(self._ctype(typespec['to']))
+        if which == 'array':
+            length = typespec['length']
+            if not isinstance(length, (int, long, type(None))):
+                raise TypeError("unresolved array length: %r" % length)
+            return self._ctype(typespec['ctype']) * (length or 0)
+        if which == 'cfunc':
+            return ctypes.CFUNCTYPE(self._ctype(typespec['restype']),
+                *[self._ctype(argtype) for argtype in typespec['argtypes']])
+        if which in ('struct', 'union', 'opaque'):
+            return self._record(typespec, None)
+        raise TypeError("no ctype for %r" % (typespec,))
+
+    def _record(self, typespec, name):
+        base = ctypes.Union if typespec['type'] == 'union' else ctypes.Structure
+        record = type(str(name or 'anonymous'), (base,), {})
+        if name is not None:
+            self._types[name] = record
+        if typespec['type'] == 'opaque':
+            return record
+        fields = []
+        anonymous = []
+        for field_name, field_type in typespec['fields']:
+            field_type = self._typespec(field_type)
+            is_bitfield = isinstance(field_type, dict) and field_type['type'] == 'bitfield'
+            if field_name is None:
+                field_name = '_anonymous{}'.format(len(fields))
+                if not is_bitfield:
+                    anonymous.append(field_name)
+            if is_bitfield:
+                fields.append((str(field_name), self._ctype(field_type['ctype']), field_type['width']))
+            else:
+                fields.append((str(field_name), self._ctype(field_type)))
+        if len(anonymous) > 0:
+            record._anonymous_ = anonymous
+        fields, packed = layout_fields(base, fields, typespec)
+        if packed:
+            record._pack_ = 1
+        record._fields_ = fields
+        return record
+
+def layout_fields(base, fields, typespec):
+    """The ctypes lays out the fields the same way as gcc, except for the
+    packed and aligned attributes. If the layout in the typespec disagrees,
+    the fields are packed with explicit padding between them."""
+    if 'offsets' not in typespec or 'shifts' in typespec:
+        return fields, False
+    native = type('native', (base,), {'_fields_': fields})
+    offsets = [getattr(native, field[0]).offset for field in fields]
+    if offsets == typespec['offsets'] and ctypes.sizeof(native) == typespec['size']:
+        return fields, False
+    padded = []
+    end = 0
+    for field, offset in zip(fields, typespec['offsets']):
+        if offset > end:
+            padded.append(('_padding{}'.format(len(padded)), ctypes.c_ubyte * (offset - end)))
+        padded.append(field)
+        end = max(end, offset + ctypes.sizeof(field[1]))
+    if typespec['size'] > end:
+        padded.append(('_padding{}'.format(len(padded)), ctypes.c_ubyte * (typespec['size'] - end)))
+    return padded, True
+
+class Loader(object):
+    "Loads the libraries by name, and each of their dependencies when first needed."
+    def __init__(self, find):
+        self.find = find # Returns the (bindings, shared library path) of a name.
+        self.libraries = {}
+
+    def load(self, name):
+        if name not in self.libraries:
+            bindings, path = self.find(name)
+            self.libraries[name] = Library(bindings, path, self.load)
+        return self.libraries[name]
@@ -1,9 +1,19 @@
-from subprocess import check_output
-from tokenizer import tokenize
+from collections import deque, OrderedDict
+from subprocess import check_output, CalledProcessError, Popen, PIPE
+from tokenizer import scan, scan_chunks, parse_line_marker
 import lrkit
-from lrkit import canonical, Rule, Accept
+from lrkit import canonical, Rule
+import cPickle as pickle
+import copy_reg
+from cStringIO import StringIO
+import grammar_compiler
+import hashlib
+import layout
+import multiprocessing
 import operator
+import os
 import re
+import traceback
 
 class Environment(object):
     def __init__(self):
@@ -15,6 +25,20 @@ class Environment(object):
         self.names = {}
         self.hard_to_parse_macros = {}
         self.unparsed_parametric_macros = {}
+        self.constant_origins = {}
+        self.constant_cycles = []
+        self.line_marker = None
+        self.abi = layout.default_abi()
+        self.chunks = None # The digests of the parsed chunks, in a snapshot.
+        self.parse_errors = [] # The (error, first, last) of the skipped declarations.
+        self.events = None # The declaration events of an iterparse, until they're given.
+
+    def origin(self, lineno):
+        "The (filename, line) that a line in the preprocessor output came from."
+        if self.line_marker is None:
+            return None
+        marker_lineno, line, path = self.line_marker
+        return path, line + lineno - marker_lineno - 1
 
 class Specifier(object):
     def __init__(self):
@@ -25,8 +49,9 @@ class Specifier(object):
         return ' '.join(list(self.qualifiers) + map(str, self.specifiers))
 
 class Declarator(object):
-    def __init__(self, name):
+    def __init__(self, name, origin=None):
         self.name = name
+        self.origin = origin
         self.initializer = None
         self.attributes = ()
         self.specifiers = []
@@ -45,22 +70,32 @@ class Declarator(object):
 class Enum(object):
     def __init__(self, constants):
         self.name = None
+        self.origin = None
         self.constants = constants
 
 class Structure(object):
     which = 'struct'
     def __init__(self, fields):
         self.name   = None
+        self.origin = None
         self.fields = fields
+        self.attributes = []
 
 class Union(object):
     which = 'union'
     def __init__(self, fields):
         self.name   = None
+        self.origin = None
         self.fields = fields
+        self.attributes = []
 
 class Unresolved(object):
-    pass
+    def names(self):
+        "Names of the constants this expression refers to."
+        return []
+
+    def evaluate(self, resolver):
+        return self
 
 class Identifier(Unresolved):
     "When a name cannot be resolved"
@@ -70,23 +105,18 @@ class Identifier(Unresolved):
     def __repr__(self):
         return 'unresolved({})'.format(self.name)
 
-    def attempt_resolve(self, env):
-        if self.name in env.constants:
-            const = env.constants[self.name]
-            if const is self:
-                return const
-            if isinstance(const, Unresolved):
-                const = const.attempt_resolve(env)
-                env.constants[self.name] = const
-            return const
-        return self
+    def names(self):
+        return [self.name]
+
+    def evaluate(self, resolver):
+        return resolver.lookup(self.name, self)
 
 class Sizeof(Unresolved):
     def __init__(self, typesign):
         self.typesign = typesign
 
-    def attempt_resolve(self, env):
-        return self
+    def evaluate(self, resolver):
+        return resolver.sizeof(self.typesign, self)
 
 class BinOp(Unresolved):
     def __init__(self, op, lhs, rhs):
@@ -97,9 +127,12 @@ class BinOp(Unresolved):
     def __repr__(self):
         return '({} {} {})'.format(self.lhs, self.op, self.rhs)
 
-    def attempt_resolve(self, env):
-        lhs = self.lhs.attempt_resolve(env) if isinstance(self.lhs, Unresolved) else self.lhs
-        rhs = self.rhs.attempt_resolve(env) if isinstance(self.rhs, Unresolved) else self.rhs
+    def names(self):
+        return names_of(self.lhs) + names_of(self.rhs)
+
+    def evaluate(self, resolver):
+        lhs = resolver.evaluate(self.lhs)
+        rhs = resolver.evaluate(self.rhs)
         if isinstance(lhs, Unresolved) or isinstance(rhs, Unresolved):
             return self
         return operator_table[self.op](lhs, rhs)
@@ -110,23 +143,59 @@ class Comparison(Unresolved):
         self.yes = yes
         self.no = no
 
+    def __repr__(self):
+        return '({} ? {} : {})'.format(self.cond, self.yes, self.no)
+
+    def names(self):
+        return names_of(self.cond) + names_of(self.yes) + names_of(self.no)
+
+    def evaluate(self, resolver):
+        cond = resolver.evaluate(self.cond)
+        if isinstance(cond, Unresolved):
+            return self
+        value = resolver.evaluate(self.yes if cond else self.no)
+        if isinstance(value, Unresolved):
+            return self
+        return value
+
 class Unary(Unresolved):
     def __init__(self, which, rhs):
         self.which = which
         self.rhs = rhs
 
+    def __repr__(self):
+        return '({}{})'.format(self.which, self.rhs)
+
+    def names(self):
+        return names_of(self.rhs)
+
+    def evaluate(self, resolver):
+        rhs = resolver.evaluate(self.rhs)
+        if isinstance(rhs, Unresolved):
+            return self
+        return unary_table[self.which](rhs)
+
+def names_of(value):
+    if isinstance(value, Unresolved):
+        return value.names()
+    return []
+
 rules = []
+grammar = []
 labelled_rules = {}
 
 def rule(string, label=None):
     lhs, rhs = string.split(' = ')
-    rule = Rule(lhs.strip(), [a for a in rhs.strip().split(' ') if len(a) > 0])
+    lhs = lhs.strip()
+    rhs = [a for a in rhs.strip().split(' ') if len(a) > 0]
+    rule = Rule(lhs, rhs)
     if label is not None:
         labelled_rules[label] = rule
     def _impl_(func):
         rule.func = func
         return func
     rules.append(rule)
+    grammar.append((lhs, rhs))
     return _impl_
 
 @rule('translation_unit = ')
@@ -192,10 +261,19 @@ def on_declaration(lineno, env, specifier, declarators, *sm):
         declarator.qualifiers = specifier.qualifiers
         if typedef:
             env.types[declarator.name] = declarator
+            declared(env, 'typedef', declarator.name, declarator)
         else:
             env.names[declarator.name] = declarator
+            if len(declarator) > 0 and declarator[0][0] == 'function':
+                declared(env, 'function', declarator.name, declarator)
+            else:
+                declared(env, 'variable', declarator.name, declarator)
     return declarators
 
+def declared(env, kind, name, obj):
+    if env.events is not None:
+        env.events.append((kind, name, obj))
+
 # commented out, because they unlikely appear in a header file,
 # and they would interfere with the simple interpretation of declaration above.
 #@rule('function_definition = declaration_specifiers declarator declaration_list compound_statement')
@@ -217,10 +295,12 @@ def on_declarator_pointer(lineno, env, pointers, declarator):
 def on_one_pointer(lineno, env, star, qualifier_list):
     return [('pointer', set(qualifier_list))]
 
+# The stack of a declarator goes from the name outwards, so the pointer
+# written last comes first.
 @rule('pointer = STAR blank_list pointer')
 @rule('pointer = STAR type_qualifier_list pointer')
 def on_many_pointers(lineno, env, star, qualifier_list, pointer):
-    return [('pointer', set(qualifier_list))] + pointer
+    return pointer + [('pointer', set(qualifier_list))]
 
 @rule('declarator = direct_declarator')
 def on_declarator(lineno, env, declarator):
@@ -228,7 +308,7 @@ def on_declarator(lineno, env, declarator):
 
 @rule('direct_declarator = IDENTIFIER')
 def on_direct_declarator_simple(lineno, env, declarator):
-    return Declarator(declarator)
+    return Declarator(declarator, env.origin(lineno))
 
 @rule('direct_declarator = LEFT_PAREN declarator RIGHT_PAREN')
 def on_pointer_declarator_simple(lineno, env, lp, declarator, rp):
@@ -317,8 +397,9 @@ def on_blank_declaration_specifier(lineno, env):
 def on_qualifier(lineno, env, block, qualifier):
     if isinstance(qualifier, str):
         block.qualifiers.add(qualifier)
-    else:
-        which, info = qualifier
+    elif len(block.specifiers) > 0 and isinstance(block.specifiers[-1], (Structure, Union)):
+        # struct name {...} __attribute__((packed))
+        block.specifiers[-1].attributes.append(qualifier)
     return block
 
 @rule('declaration_specifiers = blank_declaration_specifier type_specifier')
@@ -435,13 +516,22 @@ def on_initializer_list(lineno, env, lb, initlist, *rest):
 @rule('struct_or_union_specifier = struct_or_union blank             LEFT_BRACE struct_declaration_list RIGHT_BRACE')
 @rule('struct_or_union_specifier = struct_or_union struct_identifier')
 def on_struct_or_union_specifier(lineno, env, which, name, lb=None, block=None, rb=None):
-    cls, space = which
+    cls, space, origin = which
+    attribute = None
+    if isinstance(name, tuple):
+        name, attribute = name
     obj = space[name] if name in space else cls(None)
     obj.name = name
+    if attribute is not None:
+        obj.attributes.append(attribute)
+    if block is not None or obj.origin is None:
+        obj.origin = origin
     if block is not None:
         obj.fields = block
     if name is not None:
         space[name] = obj
+        if block is not None:
+            declared(env, 'struct' if cls is Structure else 'union', name, obj)
     return obj
 
 @rule('struct_identifier = IDENTIFIER')
@@ -451,13 +541,16 @@ def on_struct_identifier(lineno, env, name):
 
 @rule('struct_identifier = attribute_specifier IDENTIFIER')
 @rule('struct_identifier = attribute_specifier TYPE_NAME')
-def on_struct_identifier_with_attribute(lineno, env, _, name):
-    return name
+def on_struct_identifier_with_attribute(lineno, env, attribute, name):
+    return (name, attribute)
 
+# A specifier is reduced at the token after its '}', so its origin is
+# taken here, at the token after the keyword: the tag or the '{'.
 @rule('struct_or_union = STRUCT')
 @rule('struct_or_union = UNION')
 def on_struct_or_union(lineno, env, which):
-    return {'struct':(Structure, env.structs), 'union':(Union, env.unions)}[which]
+    cls, space = {'struct':(Structure, env.structs), 'union':(Union, env.unions)}[which]
+    return cls, space, env.origin(lineno)
 
 @rule('struct_declaration = specifier_qualifier_list struct_declarator_list SEMICOLON')
 def on_struct_declaration(lineno, env, specifier, declarators, sm):
@@ -471,6 +564,7 @@ def on_struct_declaration(lineno, env, specifier, declarators, ass, sm):
     for declarator in declarators:
         declarator.specifiers = specifier.specifiers
         declarator.qualifiers = specifier.qualifiers
+        declarator.attributes = [ass]
     return declarators
 
 @rule('struct_declaration = specifier_qualifier_list SEMICOLON')
@@ -495,27 +589,35 @@ def on_bitfield_struct_declarator(lineno, env, declarator, colon, expr):
     declarator.stack.append(('bitfield', expr))
     return declarator
 
-@rule('enum_specifier = ENUM LEFT_BRACE enumerator_list RIGHT_BRACE')
-@rule('enum_specifier = ENUM LEFT_BRACE enumerator_list COMMA RIGHT_BRACE')
-def on_plain_enum_specifier(lineno, env, enum, lb, constants, *_):
-    return Enum(constants)
+@rule('enum_keyword = ENUM')
+def on_enum_keyword(lineno, env, enum):
+    return env.origin(lineno)
 
-@rule('enum_specifier = ENUM IDENTIFIER LEFT_BRACE enumerator_list RIGHT_BRACE')
-@rule('enum_specifier = ENUM IDENTIFIER LEFT_BRACE enumerator_list COMMA RIGHT_BRACE')
-def on_named_enum_specifier(lineno, env, enum, name, lb, constants, *_):
+@rule('enum_specifier = enum_keyword LEFT_BRACE enumerator_list RIGHT_BRACE')
+@rule('enum_specifier = enum_keyword LEFT_BRACE enumerator_list COMMA RIGHT_BRACE')
+def on_plain_enum_specifier(lineno, env, origin, lb, constants, *_):
+    enum = Enum(constants)
+    enum.origin = origin
+    return enum
+
+@rule('enum_specifier = enum_keyword IDENTIFIER LEFT_BRACE enumerator_list RIGHT_BRACE')
+@rule('enum_specifier = enum_keyword IDENTIFIER LEFT_BRACE enumerator_list COMMA RIGHT_BRACE')
+def on_named_enum_specifier(lineno, env, origin, name, lb, constants, *_):
     enum = env.enums[name] if name in env.enums else Enum(None)
     enum.name = name
+    enum.origin = origin
     enum.constants = constants
-    if name in env.enums:
-        env.enums[name] = enum
+    env.enums[name] = enum
+    declared(env, 'enum', name, enum)
     return enum
 
-@rule('enum_specifier = ENUM IDENTIFIER')
-def on_enum_specifier(lineno, env, enum, name):
+@rule('enum_specifier = enum_keyword IDENTIFIER')
+def on_enum_specifier(lineno, env, origin, name):
     enum = env.enums[name] if name in env.enums else Enum(None)
     enum.name = name
-    if name in env.enums:
-        env.enums[name] = enum
+    if enum.origin is None:
+        enum.origin = origin
+    env.enums[name] = enum
     return enum
 
 @rule('enumerator_list = enumerator')
@@ -523,14 +625,19 @@ def on_first_enumerator(lineno, env, enumerator):
     ident, const = enumerator
     const = 0 if const is None else const
     env.constants[ident] = const
+    env.constant_origins[ident] = env.origin(lineno)
     return [(ident, const)]
 
 @rule('enumerator_list = enumerator_list COMMA enumerator')
 def on_more_enumerators(lineno, env, enumerators, comma, enumerator):
     previous_const = enumerators[-1][1]
     ident, const = enumerator
-    const = previous_const + 1 if const is None else const
+    if const is None and isinstance(previous_const, Unresolved):
+        const = BinOp('+', previous_const, 1)
+    elif const is None:
+        const = previous_const + 1
     env.constants[ident] = const
+    env.constant_origins[ident] = env.origin(lineno)
     enumerators.append((ident, const))
     return enumerators
 
@@ -554,9 +661,9 @@ def on_ignore_it_all(lineno, env, *ignore):
 
 @rule('constant_expression = constant_comparison QUESTION constant_comparison COLON constant_comparison')
 def on_const_comparison(lineno, env, cond, q, tru, c, fal):
-    if isinstance(cond, BinOp):
+    if isinstance(cond, Unresolved):
         return Comparison(cond, tru, fal)
-    return [tru, fal][cond]
+    return tru if cond else fal
 
 @rule('constant_expression = constant_bitor')
 @rule('constant_bitor = constant_comparison')
@@ -600,6 +707,11 @@ operator_table = {
     '+':operator.add,
 }
 
+unary_table = {
+    '+':operator.pos,
+    '-':operator.neg,
+}
+
 @rule('constant_term = IDENTIFIER')
 def on_constant_term(lineno, env, name):
     if name in env.constants:
@@ -849,21 +961,86 @@ def on_macro_expression(lineno, env, const):
 #def on_int_default(lineno, prim):
 #    return prim_space[prim]
 
-translation_unit = canonical.simulate(rules, 'translation_unit')
-
 attribute_conflict = set([labelled_rules['storage_attribute'], labelled_rules['declarator_attribute']])
-
-remaining_conflicts = []
-for row, name, group in translation_unit.conflicts:
-    if group == attribute_conflict:
-        translation_unit.table[row][name] = labelled_rules['declarator_attribute']
-        continue
-    remaining_conflicts.append((row, name, group))
-translation_unit.conflicts = remaining_conflicts
-assert len(translation_unit.conflicts) == 0, lrkit.diagnose(translation_unit)
-
-macro_expression = canonical.simulate(rules, 'macro_expression')
-assert len(macro_expression.conflicts) == 0, lrkit.diagnose(translation_unit)
+attribute_resolution = labelled_rules['declarator_attribute']
+
+# Building the LR(1) tables takes a while, so they are stored on the disk
+# and reused for as long as the grammar stays the same. The tables can also
+# be compiled ahead of time into parser_tables.py with grammar_compiler.py
+table_cache_version = 2
+table_cache_path = os.environ.get('CFFI_GEN_TABLE_CACHE',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'parser.tables'))
+table_names = ['translation_unit', 'macro_expression']
+
+def grammar_digest():
+    index = dict((id(rule), i) for i, rule in enumerate(rules))
+    digest = hashlib.sha1('version {}\n'.format(table_cache_version))
+    for lhs, rhs in grammar:
+        digest.update('{} = {}\n'.format(lhs, ' '.join(rhs)))
+    digest.update('conflict {} -> {}\n'.format(
+        sorted(index[id(rule)] for rule in attribute_conflict),
+        index[id(attribute_resolution)]))
+    return digest.hexdigest()
+
+def load_compiled_tables(digest):
+    try:
+        import parser_tables
+    except ImportError:
+        return None
+    if parser_tables.digest != digest:
+        return None
+    return grammar_compiler.load_module(parser_tables, table_names)
+
+def load_cached_tables(digest):
+    try:
+        with open(table_cache_path, 'rb') as fd:
+            cached_digest, data = pickle.load(fd)
+    except Exception:
+        return None
+    if cached_digest != digest:
+        return None
+    return grammar_compiler.load_tables(data)
+
+def store_cached_tables(digest, tables):
+    # Written into a temporary file first, so that processes
+    # starting concurrently never see a partial cache.
+    temp_path = '{}.{}'.format(table_cache_path, os.getpid())
+    try:
+        with open(temp_path, 'wb') as fd:
+            pickle.dump((digest, grammar_compiler.dump_tables(tables)),
+                fd, pickle.HIGHEST_PROTOCOL)
+        os.rename(temp_path, table_cache_path)
+    except (IOError, OSError):
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def build_tables():
+    translation_unit = canonical.simulate(rules, 'translation_unit')
+    remaining_conflicts = []
+    for row, name, group in translation_unit.conflicts:
+        if group == attribute_conflict:
+            translation_unit.table[row][name] = attribute_resolution
+            continue
+        remaining_conflicts.append((row, name, group))
+    translation_unit.conflicts = remaining_conflicts
+    assert len(translation_unit.conflicts) == 0, lrkit.diagnose(translation_unit)
+
+    macro_expression = canonical.simulate(rules, 'macro_expression')
+    assert len(macro_expression.conflicts) == 0, lrkit.diagnose(translation_unit)
+    return grammar_compiler.compile_tables(rules, grammar,
+        [translation_unit, macro_expression])
+
+def get_tables():
+    digest = grammar_digest()
+    tables = load_compiled_tables(digest)
+    if tables is None:
+        tables = load_cached_tables(digest)
+    if tables is None:
+        tables = build_tables()
+        store_cached_tables(digest, tables)
+    return [table.bind(rules) for table in tables]
+
+translation_unit, macro_expression = get_tables()
 
 class SnError(Exception):
     def __init__(self, lineno, message):
@@ -871,6 +1048,9 @@ class SnError(Exception):
         self.extra = []
         Exception.__init__(self, message)
 
+    def __reduce__(self):
+        return SnError, (self.lineno, self.message), self.__dict__
+
     def __str__(self):
         return self.message + ''.join('\n'+x for x in self.extra)
 
@@ -881,46 +1061,136 @@ class Parser(object):
         self.stack = []
         self.data  = []
         self.env = env
+        self.depth = 0
+
+    def reset(self):
+        self.state = 0
+        del self.stack[:]
+        del self.data[:]
+        self.depth = 0
 
     def step(self, lineno, group, value):
-        if group == 'IDENTIFIER' and value in self.env.types:
-            if 'TYPE_NAME' in self.table[self.state]:
-                group = 'TYPE_NAME'
-        action = self.table[self.state].get(group, self.table[self.state].get('*'))
-        while isinstance(action, Rule):
-            values = []
-            for i in range(len(action)):
+        if self.depth > 0:
+            return self.skip(lineno, group)
+        table = self.table
+        width = table.width
+        actions = table.action
+        term = table.terminal_index.get(group, table.wildcard)
+        type_name = group == 'IDENTIFIER' and value in self.env.types
+        if type_name and table.type_names[self.state]:
+            term = table.type_name
+        action = actions[self.state*width + term]
+        while action < 0:
+            index = ~action
+            if index == table.accept:
                 self.state = self.stack.pop(-1)
-                values.append(self.data.pop(-1))
-            values.reverse()
+                return self.data.pop(-1)
+            length, lhs = table.reductions[index]
+            if length > 0:
+                values = self.data[-length:]
+                del self.data[-length:]
+                self.state = self.stack[-length]
+                del self.stack[-length:]
+            else:
+                values = ()
             self.stack.append(self.state)
-            self.data.append(action.func(lineno, self.env, *values))
-            self.state = self.table[self.state][action.lhs]
-
-            if group == 'IDENTIFIER' and value in self.env.types:
-                if 'TYPE_NAME' in self.table[self.state]:
-                    group = 'TYPE_NAME'
-            action = self.table[self.state].get(group, self.table[self.state].get('*'))
-        if action is None:
-            error = "%i: got %s, but expected %s: %s" % (lineno, group, ', '.join(map(str, self.table[self.state])), value)
-            #if headers.find('namespace') >= 0 or headers.find('class') >= 0:
-            #    raise Exception(error)
-            #logs.write("%s:%s\n" % (path, error))
-            #lines = headers.splitlines()
-            #logs.write("-"*30 + "\n")
-            #logs.write('\n'.join(lines[lineno-1:lineno+2]) + '\n')
-            #logs.write("-"*30 + "\n")
+            self.data.append(table.funcs[index](lineno, self.env, *values))
+            self.state = table.goto[self.state*table.goto_width + lhs]
+
+            # The reduction may have declared the identifier as a typedef.
+            type_name = group == 'IDENTIFIER' and value in self.env.types
+            if type_name and table.type_names[self.state]:
+                term = table.type_name
+            action = actions[self.state*width + term]
+        if action == 0:
+            error = "%i: got %s, but expected %s: %s" % (lineno, group, ', '.join(map(str, table.expected(self.state))), value)
             raise SnError(lineno, error)
-        if isinstance(action, Accept):
-            self.state  = self.stack.pop(-1)
-            result = self.data.pop(-1)
-            return result
-        else:
-            self.stack.append(self.state)
-            self.data.append(value)
-            self.state = action
+        if term == table.left_brace and table.body_states[self.state]:
+            self.depth = 1
+            return
+        self.stack.append(self.state)
+        self.data.append(value)
+        self.state = action - 1
+
+    # The function bodies in headers are ignored, so instead of parsing
+    # them, the tokens are skipped up to the matching '}' and an empty
+    # compound_statement is pushed in their place.
+    def skip(self, lineno, group):
+        if group == 'LEFT_BRACE':
+            self.depth += 1
+        elif group == 'RIGHT_BRACE':
+            self.depth -= 1
+            if self.depth == 0:
+                table = self.table
+                self.stack.append(self.state)
+                self.data.append(None)
+                self.state = table.goto[self.state*table.goto_width + table.compound_statement]
+        elif group is None:
+            raise SnError(lineno, "%i: got %s inside a compound statement" % (lineno, group))
+
+# With recover=True, a declaration that doesn't parse doesn't stop the
+# parse. The error is recorded in env.parse_errors, along with the origins
+# of the first and the last token of the declaration, and the tokens are
+# skipped up to the next ';' or function body '}' outside of any brackets.
+# There the parser starts over. The declarations parsed before the error,
+# and the structs, unions and enums completed inside it, are kept.
+class RecoveringParser(object):
+    def __init__(self, parser, context):
+        self.parser = parser
+        self.env = parser.env
+        self.context = context # Adds the context of the error to it.
+        self.depth = 0
+        self.body = False
+        self.previous = None
+        self.first = None # The origin of the declaration.
+        self.error = None # Set while the declaration is skipped.
+
+    def step(self, lineno, group, value):
+        if group is None:
+            return self.finish(lineno)
+        if self.first is None:
+            self.first = self.env.origin(lineno)
+        boundary = False
+        if group in ('LEFT_PAREN', 'LEFT_BRACKET', 'LEFT_BRACE'):
+            if self.depth == 0 and group == 'LEFT_BRACE':
+                self.body = self.previous == 'RIGHT_PAREN'
+            self.depth += 1
+        elif group in ('RIGHT_PAREN', 'RIGHT_BRACKET', 'RIGHT_BRACE'):
+            self.depth = max(self.depth - 1, 0)
+            boundary = self.depth == 0 and group == 'RIGHT_BRACE' and self.body
+            if boundary:
+                self.body = False
+        elif group == 'SEMICOLON':
+            boundary = self.depth == 0
+        self.previous = group
+        if self.error is None:
+            try:
+                self.parser.step(lineno, group, value)
+            except SnError as error:
+                self.context(error)
+                self.error = error
+        if boundary:
+            if self.error is not None:
+                self.skipped(lineno)
+            self.first = None
+
+    def finish(self, lineno):
+        if self.error is None:
+            try:
+                return self.parser.step(lineno, None, None)
+            except SnError as error:
+                self.context(error)
+                self.error = error
+        self.skipped(lineno)
+
+    def skipped(self, lineno):
+        self.env.parse_errors.append((self.error, self.first, self.env.origin(lineno)))
+        self.error = None
+        self.parser.reset()
 
 macroregex = re.compile(r"(\w+(\([^\)]*\))?)\s*(.*)")
+identifierregex = re.compile(r"[A-Za-z_]\w*")
+directiveregex = re.compile(r"#\s*(define|undef)\s+(\w+)(.*)", re.DOTALL)
 
 def default_env():
     env = Environment()
@@ -932,57 +1202,718 @@ def default_env():
     })
     return env
 
-def parse(env, includes, lce=5, extra_flags=()):
-    includes = list(includes)
-    parser = Parser(translation_unit.table, env)
+# With stream=True, the output of gcc -E is tokenized and parsed while
+# the preprocessor is still running, stream_chunk_size bytes at a time.
+#
+# With single_run=True, gcc runs only once, with -dD. The #define and
+# #undef lines in its output are collected during the parse, and give
+# the same macro table that gcc -dM would. Only this way do the macros
+# get their origins in env.constant_origins, gcc -dM doesn't tell where
+# they were defined, so otherwise their origin is None.
+stream_chunk_size = 1 << 16
 
-    headers = check_output(['gcc', '-E'] + includes + list(extra_flags))
-    token_stream = tokenize(headers)
+#
+# If a preprocess_cache.PreprocessCache is given, gcc isn't run again
+# for as long as none of the headers it read have changed.
+#
+# The select_macros picks the object-like macros to evaluate, along with
+# the macros they refer to. It's a prefix or a tuple of them, a compiled
+# regex or a function taking the name. By default every macro is evaluated.
+def parse(env, includes, lce=5, extra_flags=(), stream=False, single_run=False,
+        cache=None, select_macros=None, workers=None, recover=False):
+    for event in parse_events(env, includes, None, lce, extra_flags, stream, single_run,
+            cache, select_macros, workers, recover):
+        pass
+
+# An iterparse gives a (kind, name, object) event for every declaration as
+# soon as it has been parsed, while the parse goes on. The kind is one of
+# 'typedef', 'function' or 'variable' with a Declarator, 'struct', 'union'
+# or 'enum' for a named definition, and 'constant' for an evaluated macro,
+# with its value. The constants come last, as they're resolved only after
+# the declarations. The environment is filled as by parse, but only when
+# the events have been read to the end. The events make the parse serial.
+def iterparse(env, includes, **options):
+    return parse_events(env, includes, [], **options)
+
+def parse_events(env, includes, events, lce=5, extra_flags=(), stream=False, single_run=False,
+        cache=None, select_macros=None, workers=None, recover=False):
+    includes = list(includes)
+    parser = Parser(translation_unit, env)
+    env.abi = layout.abi_for_flags(extra_flags, env.abi)
+
+    args = ['gcc', '-E'] + includes + list(extra_flags)
+    if single_run:
+        args.insert(2, '-dD')
+    if stream:
+        output = open_stream(args, cache)
+        token_stream = scan_chunks(output)
+    else:
+        headers = preprocess(args, cache)
+        token_stream = scan(headers)
+    defines = OrderedDict()
+    env.line_marker = None
+
+    def supply_context(error, ahead=True):
+        origin = env.origin(error.lineno)
+        if origin is not None:
+            error.extra.append('in {}, line {}'.format(*origin))
+        if stream:
+            supply_snerror_extra(error, output.context(ahead), lce, output.context_lineno)
+        else:
+            supply_snerror_extra(error, headers, lce)
+
+    if recover:
+        # The stream can't be read ahead, the parse goes on after the error.
+        parser = RecoveringParser(parser, lambda error: supply_context(error, False))
+    chunks = None if env.chunks is None else ChunkFilter(env, parser)
+    tokens = None if workers in (None, 1) or chunks is not None or recover else []
+    if events is not None:
+        tokens = None
+    env.events = events
     try:
         for lineno, group, value in token_stream:
+            if events:
+                for event in events:
+                    yield event
+                del events[:]
             if group == 'MACRO':
+                marker = parse_line_marker(value)
+                if marker is not None:
+                    if chunks is not None:
+                        chunks.flush()
+                    env.line_marker = (lineno,) + marker
+                    if tokens is not None:
+                        tokens.append((lineno, group, env.line_marker))
+                elif single_run:
+                    collect_define(defines, value, env.origin(lineno))
                 continue
-            parser.step(lineno, group, value)
-        result = parser.step(lineno, None, None)
+            if tokens is not None:
+                tokens.append((lineno, group, value))
+            elif chunks is not None:
+                chunks.tokens.append((lineno, group, value))
+            else:
+                parser.step(lineno, group, value)
+        if tokens is not None:
+            parse_declarations(env, tokens, workers)
+        else:
+            if chunks is not None:
+                chunks.flush()
+            result = parser.step(lineno, None, None)
+        if events:
+            for event in events:
+                yield event
     except SnError as error:
-        supply_snerror_extra(error, headers, lce)
+        supply_context(error)
         raise
+    finally:
+        env.events = None
+        if stream:
+            output.close()
 
-    macros = check_output(['gcc', '-dM', '-E'] + includes + list(extra_flags))
-    for line in [macro.strip() for macro in macros.split('#define')]:
+    if single_run:
+        macros = defines.values()
+    else:
+        macro_args = ['gcc', '-dM', '-E'] + includes + list(extra_flags)
+        macros = preprocess(macro_args, cache, depends_on=args)
+        macros = [(macro.strip(), None) for macro in macros.split('#define')]
+    definitions = []
+    for line, origin in macros:
         if line == "":
             continue
         match = macroregex.match(line)
         name, arglist, macrostring = match.groups()
         if arglist is None:
-            groups = []
-            values = []
-            try:
-                parser = Parser(macro_expression.table, env)
-                for lineno, group, value in tokenize(macrostring.strip()):
-                    parser.step(lineno, group, value)
-                result = parser.step(lineno, None, None)
-                if result is not None:
-                    env.constants[name] = result
-            except SnError as e:
-                env.hard_to_parse_macros[name] = (macrostring, e)
+            definitions.append((name, macrostring, origin))
         else:
             env.unparsed_parametric_macros[name] = (name, arglist, macrostring)
-    for name in env.constants:
-        const = env.constants[name]
+    if select_macros is not None:
+        definitions = select_definitions(definitions, name_selector(select_macros))
+    parser = Parser(macro_expression, env)
+    evaluated = []
+    for name, macrostring, origin in definitions:
+        macrostring = macrostring.strip()
+        if macrostring == "":
+            continue
+        parser.reset()
+        try:
+            for lineno, group, value in scan(macrostring):
+                parser.step(lineno, group, value)
+            result = parser.step(lineno, None, None)
+            if result is not None:
+                env.constants[name] = result
+                env.constant_origins[name] = origin
+                evaluated.append(name)
+        except SnError as e:
+            env.hard_to_parse_macros[name] = (macrostring, e)
+    resolve_constants(env)
+    if events is not None:
+        for name in evaluated:
+            yield 'constant', name, env.constants[name]
+
+# A snapshot is an environment parsed from the headers that many libraries
+# include, to start their parses from. It records a digest of every chunk
+# of tokens it parsed, a chunk being the tokens between two line markers.
+# When a chunk shows up again between two declarations, it's skipped, as
+# the environment already has its declarations. The macros are evaluated
+# again, since their values may depend on the new ones.
+class Snapshot(object):
+    def __init__(self, env):
+        self.data = pickle.dumps(env, pickle.HIGHEST_PROTOCOL)
+
+    def environment(self):
+        "A copy of the environment of the snapshot."
+        return pickle.loads(self.data)
+
+def snapshot(includes, env=None, **options):
+    "Parses the headers and snapshots the environment."
+    if env is None:
+        env = default_env()
+    if env.chunks is None:
+        env.chunks = set()
+    parse(env, includes, **options)
+    return Snapshot(env)
+
+class ChunkFilter(object):
+    def __init__(self, env, parser):
+        self.env = env
+        self.parser = parser
+        self.tokens = []
+        self.depth = 0
+        self.boundary = True # Between two declarations.
+
+    def flush(self):
+        tokens = self.tokens
+        if len(tokens) == 0:
+            return
+        groups = [token[1] for token in tokens]
+        values = [token[2] for token in tokens]
+        digest = hashlib.sha1(repr(self.env.line_marker and self.env.line_marker[1:]))
+        digest.update('\0'.join(groups))
+        digest.update(repr(values))
+        digest = digest.digest()
+        start = self.boundary
+        self.depth += (groups.count('LEFT_PAREN') + groups.count('LEFT_BRACKET')
+            + groups.count('LEFT_BRACE') - groups.count('RIGHT_PAREN')
+            - groups.count('RIGHT_BRACKET') - groups.count('RIGHT_BRACE'))
+        self.boundary = self.depth == 0 and groups[-1] == 'SEMICOLON'
+        if not (start and digest in self.env.chunks):
+            for lineno, group, value in tokens:
+                self.parser.step(lineno, group, value)
+            if start and self.boundary:
+                self.env.chunks.add(digest)
+        del tokens[:]
+
+# An environment is saved as two pickles: the magic and the version of the
+# format, then the environment. The version changes with the classes in the
+# environment, and the files of the other versions are refused. Pickle keeps
+# the objects shared in the environment shared when it's loaded, which the
+# Translator relies on.
+environment_magic = 'cffi-gen environment'
+environment_version = 5
+
+def save_environment(env, path):
+    temp_path = '{}.{}'.format(path, os.getpid())
+    with open(temp_path, 'wb') as fd:
+        pickle.dump((environment_magic, environment_version), fd, pickle.HIGHEST_PROTOCOL)
+        pickle.dump(env, fd, pickle.HIGHEST_PROTOCOL)
+    os.rename(temp_path, path)
+
+def load_environment(path):
+    with open(path, 'rb') as fd:
+        try:
+            magic, version = pickle.load(fd)
+        except Exception:
+            magic = version = None
+        if magic != environment_magic or version != environment_version:
+            raise ValueError("%s is not a version %d environment" % (path, environment_version))
+        return pickle.load(fd)
+
+# The header sets that don't depend on each other can be parsed in a pool
+# of processes. The workers are forked, so they share the parsing tables and
+# the jobs with the parent, and only send back their results. The Ellipsis
+# of varargs is registered with copy_reg, so that the environments pickle.
+copy_reg.pickle(type(Ellipsis), lambda obj: 'Ellipsis')
+
+parse_jobs = None
+
+def parse_many(jobs, workers=None, translate=None):
+    """Parses the (env_factory, includes, extra_flags) jobs and returns their
+    environments, in order. A job may have a fourth item, a dict of the other
+    arguments to parse. If translate is given, it's called in the worker with
+    each environment, and its results are returned instead."""
+    global parse_jobs
+    jobs = list(jobs)
+    if workers == 1 or len(jobs) <= 1:
+        return [run_parse_job(job, translate) for job in jobs]
+    parse_jobs = jobs, translate
+    try:
+        return pool_map(parse_job, len(jobs), workers)
+    finally:
+        parse_jobs = None
+
+def pool_map(function, count, workers):
+    "Calls the function with range(count) in a pool of forked workers."
+    pool = multiprocessing.Pool(min(workers or multiprocessing.cpu_count(), count))
+    try:
+        results = pool.map(function, range(count), chunksize=1)
+        pool.close()
+    except:
+        # The other workers may be stuck sending their results.
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return results
+
+def parse_job(index):
+    jobs, translate = parse_jobs
+    try:
+        return run_parse_job(jobs[index], translate)
+    except Exception as error:
+        # The pool hangs on the errors that don't unpickle, such as the
+        # CalledProcessError of python 2.
+        message = "parse job {} failed:\n{}".format(index, traceback.format_exc())
+        try:
+            pickle.loads(pickle.dumps(error, pickle.HIGHEST_PROTOCOL))
+        except Exception:
+            raise Exception(message)
+        raise
+
+def run_parse_job(job, translate):
+    env_factory, includes, extra_flags = job[:3]
+    options = job[3] if len(job) > 3 else {}
+    env = env_factory()
+    parse(env, includes, extra_flags=extra_flags, **options)
+    if translate is not None:
+        return translate(env)
+    return env
+
+# With workers, the declarations of a translation unit are parsed in two
+# phases. A pre-scan splits the tokens into runs of whole declarations, at
+# the ';' and the '}' of function bodies outside of any brackets, and
+# guesses the typedef names declared in each run. The runs are parsed in
+# forked workers, each one assuming the typedefs guessed before it, and
+# merged in order. The named structs and unions are sent back by name, so
+# they join the ones in the environment. A run is parsed again, in order,
+# if its identifiers disagree with the typedefs that were really declared
+# before it, if it uses an enum constant of an earlier run, or if it fails.
+declaration_jobs = None
+
+def parse_declarations(env, tokens, workers):
+    global declaration_jobs
+    runs, typedefs = split_declarations(tokens, (workers or multiprocessing.cpu_count()) * 4)
+    if len(runs) > 1:
+        declaration_jobs = env, tokens, runs, typedefs
+        try:
+            results = pool_map(parse_run, len(runs), workers)
+        finally:
+            declaration_jobs = None
+    else:
+        results = [None] * len(runs)
+    guessed = set(env.types)
+    declared = set(env.types)
+    constants = set() # The enum constants of the runs.
+    for (start, stop, line_marker), names, result in zip(runs, typedefs, results):
+        identifiers = set(value for lineno, group, value in tokens[start:stop]
+            if group == 'IDENTIFIER')
+        if (result is None or not identifiers.isdisjoint(constants) or
+                any((name in guessed) != (name in declared) for name in identifiers)):
+            existing = set(env.constants)
+            env.line_marker = line_marker
+            run_declarations(env, tokens, start, stop)
+            declared.update(env.types)
+            constants.update(name for name in env.constants if name not in existing)
+        else:
+            run = merge_run(env, result)
+            declared.update(run['types'])
+            constants.update(run['constants'])
+        guessed.update(names)
+    for lineno, group, value in reversed(tokens):
+        if group == 'MACRO':
+            env.line_marker = value
+            break
+
+def split_declarations(tokens, count):
+    """Splits the tokens into about count runs of whole declarations. Gives
+    the (start, stop, line marker) of the runs, and the typedef names each
+    run seems to declare."""
+    declarations = []
+    start = 0
+    depth = 0
+    body = False
+    previous = None
+    for index, (lineno, group, value) in enumerate(tokens):
+        if group == 'MACRO':
+            continue
+        boundary = False
+        if group in ('LEFT_PAREN', 'LEFT_BRACKET', 'LEFT_BRACE'):
+            if depth == 0 and group == 'LEFT_BRACE':
+                body = previous == 'RIGHT_PAREN'
+            depth += 1
+        elif group in ('RIGHT_PAREN', 'RIGHT_BRACKET', 'RIGHT_BRACE'):
+            depth -= 1
+            boundary = depth == 0 and group == 'RIGHT_BRACE' and body
+        elif group == 'SEMICOLON':
+            boundary = depth == 0
+        previous = group
+        if boundary:
+            declarations.append((start, index + 1))
+            start = index + 1
+    if start < len(tokens):
+        declarations.append((start, len(tokens)))
+
+    size = len(tokens) // count + 1
+    runs = []
+    typedefs = []
+    line_marker = None
+    marker_index = 0
+    for start, stop in declarations:
+        if len(runs) == 0 or runs[-1][1] - runs[-1][0] >= size:
+            for lineno, group, value in tokens[marker_index:start]:
+                if group == 'MACRO':
+                    line_marker = value
+            marker_index = start
+            runs.append([start, stop, line_marker])
+            typedefs.append(set())
+        runs[-1][1] = stop
+        typedefs[-1].update(typedef_names(tokens, start, stop))
+    return [tuple(run) for run in runs], typedefs
+
+def typedef_names(tokens, start, stop):
+    "Guesses the names a typedef declares."
+    tokens = [(group, value) for lineno, group, value in tokens[start:stop] if group != 'MACRO']
+    if 'TYPEDEF' not in [group for group, value in tokens]:
+        return []
+    names = []
+    parens = braces = 0
+    for index, (group, value) in enumerate(tokens[:-1]):
+        if group == 'LEFT_PAREN':
+            parens += 1
+        elif group == 'RIGHT_PAREN':
+            parens -= 1
+        elif group == 'LEFT_BRACE':
+            braces += 1
+        elif group == 'RIGHT_BRACE':
+            braces -= 1
+        elif group == 'IDENTIFIER' and braces == 0:
+            following = tokens[index + 1][0]
+            if parens == 0 and following in ('SEMICOLON', 'COMMA', 'LEFT_BRACKET',
+                    'LEFT_PAREN', '__ATTRIBUTE__', '__ASM__'):
+                names.append(value)
+            elif parens == 1 and following == 'RIGHT_PAREN' and tokens[index - 1][0] == 'STAR':
+                names.append(value)
+    return names
+
+def parse_run(index):
+    base, tokens, runs, typedefs = declaration_jobs
+    start, stop, line_marker = runs[index]
+    env = Environment()
+    env.abi = base.abi
+    env.structs = {}
+    env.types = dict.fromkeys(base.types)
+    for names in typedefs[:index]:
+        env.types.update(dict.fromkeys(names))
+    env.constants = dict(base.constants)
+    env.line_marker = line_marker
+    try:
+        run_declarations(env, tokens, start, stop)
+    except Exception:
+        return None # Parsed again in order, to raise the error there.
+    output = StringIO()
+    pickler = pickle.Pickler(output, pickle.HIGHEST_PROTOCOL)
+    pickler.persistent_id = record_id
+    pickler.dump({
+        'records': [(obj.which, name, obj.fields, obj.attributes, obj.origin)
+            for space in (env.structs, env.unions) for name, obj in space.iteritems()],
+        'enums': [(name, obj.constants, obj.origin) for name, obj in env.enums.iteritems()],
+        'types': dict((name, value) for name, value in env.types.iteritems() if value is not None),
+        'names': env.names,
+        'constants': dict((name, value) for name, value in env.constants.iteritems()
+            if name not in base.constants or base.constants[name] is not value),
+        'constant_origins': env.constant_origins})
+    return output.getvalue()
+
+def record_id(obj):
+    if isinstance(obj, (Structure, Union)) and obj.name is not None:
+        return obj.which, obj.name
+    if isinstance(obj, Enum) and obj.name is not None:
+        return 'enum', obj.name
+
+def merge_run(env, data):
+    def load_record(record_id):
+        which, name = record_id
+        space = {'struct': env.structs, 'union': env.unions, 'enum': env.enums}[which]
+        if name not in space:
+            obj = {'struct': Structure, 'union': Union, 'enum': Enum}[which](None)
+            obj.name = name
+            space[name] = obj
+        return space[name]
+    unpickler = pickle.Unpickler(StringIO(data))
+    unpickler.persistent_load = load_record
+    run = unpickler.load()
+    for which, name, fields, attributes, origin in run['records']:
+        obj = load_record((which, name))
+        if fields is not None or obj.origin is None:
+            obj.origin = origin
+        if fields is not None:
+            obj.fields = fields
+        obj.attributes.extend(attributes)
+    for name, constants, origin in run['enums']:
+        obj = load_record(('enum', name))
+        if constants is not None or obj.origin is None:
+            obj.origin = origin
+        if constants is not None:
+            obj.constants = constants
+    env.types.update(run['types'])
+    env.names.update(run['names'])
+    env.constants.update(run['constants'])
+    env.constant_origins.update(run['constant_origins'])
+    return run
+
+def run_declarations(env, tokens, start, stop):
+    parser = Parser(translation_unit, env)
+    lineno = tokens[start][0] if start < stop else 0
+    for lineno, group, value in tokens[start:stop]:
+        if group == 'MACRO':
+            env.line_marker = value
+        else:
+            parser.step(lineno, group, value)
+    parser.step(lineno, None, None)
+
+# The constants that depend on each other are resolved in the topological
+# order of their dependency graph, each constant and expression only once.
+# Strongly connected components are found with Tarjan's algorithm, and the
+# constants caught in a cycle are left unresolved and listed in
+# env.constant_cycles.
+def resolve_constants(env):
+    resolver = ConstantResolver(env)
+    del env.constant_cycles[:]
+    for component in strongly_connected(env.constants, resolver.dependencies):
+        name = component[0]
+        if len(component) > 1 or name in resolver.dependencies(name):
+            env.constant_cycles.append(sorted(component))
+            continue
+        const = resolver.evaluate(env.constants[name])
+        resolver.values[name] = const
+        env.constants[name] = const
+
+class ConstantResolver(object):
+    def __init__(self, env, layout=None):
+        self.env = env
+        self.layout = layout
+        self.values = {}
+        self.memo = {}
+
+    def dependencies(self, name):
+        const = self.env.constants[name]
+        return [dep for dep in names_of(const) if dep in self.env.constants]
+
+    def lookup(self, name, default):
+        if name in self.values:
+            return self.values[name]
+        const = self.env.constants.get(name, default)
         if isinstance(const, Unresolved):
-            const = const.attempt_resolve(env)
-            env.constants[name] = const
+            return default
+        return const
+
+    def evaluate(self, const):
+        if not isinstance(const, Unresolved):
+            return const
+        key = id(const)
+        if key not in self.memo:
+            self.memo[key] = const.evaluate(self)
+        return self.memo[key]
+
+    def sizeof(self, typesign, default):
+        if self.layout is None:
+            self.layout = layout.Layout(self.env)
+        try:
+            return self.layout.sizeof(typesign)
+        except layout.LayoutError:
+            return default
+
+def strongly_connected(names, edges):
+    "Yields the components, every component after the ones it depends on."
+    index = {}
+    lowlink = {}
+    stack = []
+    on_stack = set()
+    for root in names:
+        if root in index:
+            continue
+        work = [(root, iter(edges(root)))]
+        index[root] = lowlink[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        while len(work) > 0:
+            name, successors = work[-1]
+            for successor in successors:
+                if successor not in index:
+                    index[successor] = lowlink[successor] = len(index)
+                    stack.append(successor)
+                    on_stack.add(successor)
+                    work.append((successor, iter(edges(successor))))
+                    break
+                elif successor in on_stack:
+                    lowlink[name] = min(lowlink[name], index[successor])
+            else:
+                work.pop()
+                if len(work) > 0:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[name])
+                if lowlink[name] == index[name]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == name:
+                            break
+                    yield component
+
+def name_selector(select):
+    if isinstance(select, (str, tuple)):
+        return lambda name: name.startswith(select)
+    if hasattr(select, 'match'):
+        return lambda name: select.match(name) is not None
+    return select
+
+def select_definitions(definitions, selected):
+    "The selected macro definitions, and the ones they refer to."
+    bodies = dict((name, macrostring) for name, macrostring, origin in definitions)
+    needed = set()
+    pending = [name for name in bodies if selected(name)]
+    while len(pending) > 0:
+        name = pending.pop()
+        if name in needed:
+            continue
+        needed.add(name)
+        for word in identifierregex.findall(bodies[name]):
+            if word in bodies and word not in needed:
+                pending.append(word)
+    return [definition for definition in definitions if definition[0] in needed]
+
+def collect_define(defines, line, origin):
+    match = directiveregex.match(line)
+    if match is None:
+        return
+    directive, name, rest = match.groups()
+    if directive == 'define':
+        defines[name] = ((name + rest).strip(), origin)
+    else:
+        defines.pop(name, None)
 
-def supply_snerror_extra(error, source, lce):
+def supply_snerror_extra(error, source, lce, first_lineno=1):
     lines = source.splitlines()
+    index = error.lineno - first_lineno
     error.extra.append('{} lines before error:'.format(lce))
-    for line in lines[error.lineno-1-lce:error.lineno-1]:
+    for line in lines[max(index-lce, 0):index]:
         error.extra.append(line)
     error.extra.append('{} lines at error:'.format(lce))
-    for line in lines[error.lineno-1:error.lineno-1+lce]:
+    for line in lines[index:index+lce]:
         error.extra.append(line)
 
+def preprocess(args, cache=None, depends_on=None):
+    """Runs the preprocessor, or replays its output from the cache.
+    The gcc -dM output has no line markers, so it is cached with the
+    dependencies of the gcc -E run it depends_on."""
+    if cache is None:
+        return check_output(args)
+    fd = cache.open(args)
+    if fd is not None:
+        with fd:
+            return fd.read()
+    output = check_output(args)
+    dependencies = None
+    if depends_on is not None:
+        dependencies = cache.dependencies(depends_on)
+        if dependencies is None:
+            return output
+    writer = cache.create(args, dependencies)
+    writer.write(output)
+    writer.commit()
+    return output
+
+def open_stream(args, cache=None):
+    if cache is None:
+        return ProcessOutput(args, stream_chunk_size)
+    fd = cache.open(args)
+    if fd is not None:
+        return StreamingOutput(fd, stream_chunk_size)
+    return ProcessOutput(args, stream_chunk_size, cache.create(args))
+
+class StreamingOutput(object):
+    """Reads the output in chunks. The most recent chunks are kept
+    around, so that parse errors can still show where they happened."""
+    def __init__(self, fd, chunk_size, keep=3):
+        self.fd = fd
+        self.chunk_size = chunk_size
+        self.recent = deque(maxlen=keep)
+        self.lineno = 1
+
+    def __iter__(self):
+        while True:
+            chunk = self.fd.read(self.chunk_size)
+            if not chunk:
+                break
+            self.recent.append((self.lineno, chunk))
+            self.lineno += chunk.count('\n')
+            yield chunk
+        self.finish()
+
+    @property
+    def context_lineno(self):
+        if len(self.recent) > 0:
+            return self.recent[0][0]
+        return self.lineno
+
+    def context(self, ahead=True):
+        "The recent output, and one chunk read past it if ahead is set."
+        following = '' if self.fd.closed or not ahead else self.fd.read(self.chunk_size)
+        return ''.join(chunk for lineno, chunk in self.recent) + following
+
+    def finish(self):
+        self.fd.close()
+
+    def close(self):
+        self.fd.close()
+
+class ProcessOutput(StreamingOutput):
+    """Reads the output of a command in chunks, and copies
+    it into the preprocess cache if a writer is given."""
+    def __init__(self, args, chunk_size, writer=None):
+        self.args = args
+        self.process = Popen(args, stdout=PIPE)
+        self.writer = writer
+        StreamingOutput.__init__(self, self.process.stdout, chunk_size)
+
+    def __iter__(self):
+        for chunk in StreamingOutput.__iter__(self):
+            if self.writer is not None:
+                self.writer.write(chunk)
+            yield chunk
+
+    def finish(self):
+        self.fd.close()
+        if self.process.wait() != 0:
+            self.discard()
+            raise CalledProcessError(self.process.returncode, self.args)
+        if self.writer is not None:
+            self.writer.commit()
+            self.writer = None
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.kill()
+        self.fd.close()
+        self.process.wait()
+        self.discard()
+
+    def discard(self):
+        if self.writer is not None:
+            self.writer.abort()
+            self.writer = None
+
 #env = None
 #attributes = []
 ##proc = Popen(['gcc', '-E', argv[1]], stdout=PIPE)
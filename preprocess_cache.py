@@ -0,0 +1,135 @@
+from subprocess import check_output
+from tokenizer import parse_line_marker
+import hashlib
+import json
+import os
+
+# Stores the output of gcc, so that unchanged headers are not preprocessed
+# again. An entry is keyed by the command line, the working directory, the
+# gcc version and the environment variables that change the include path.
+# It's valid while every file that gcc read still has the same contents.
+# Those files are found from the line markers in the output of gcc -E.
+# The .deps of an entry are written last, and name the inode and size of
+# the .out they were written with, so that a .out left by another run
+# or a crash doesn't pass for the entry.
+
+environment_variables = ['CPATH', 'C_INCLUDE_PATH', 'GCC_EXEC_PREFIX', 'COMPILER_PATH']
+
+def default_directory():
+    return os.environ.get('CFFI_GEN_CACHE_DIR',
+        os.path.join(os.path.expanduser('~'), '.cache', 'cffi-gen'))
+
+class PreprocessCache(object):
+    def __init__(self, directory=None):
+        self.directory = default_directory() if directory is None else directory
+        self.gcc_version = None
+
+    def key(self, args):
+        if self.gcc_version is None:
+            self.gcc_version = check_output([args[0], '--version'])
+        digest = hashlib.sha1()
+        digest.update(json.dumps([
+            list(args),
+            os.getcwd(),
+            self.gcc_version,
+            [os.environ.get(name) for name in environment_variables]]))
+        return digest.hexdigest()
+
+    def path(self, args, suffix):
+        return os.path.join(self.directory, self.key(args) + suffix)
+
+    def dependencies(self, args):
+        "The files an entry depends on, or None if the entry is not valid."
+        entry = self.entry(args)
+        if entry is not None:
+            return entry['files']
+
+    def entry(self, args):
+        try:
+            with open(self.path(args, '.deps')) as fd:
+                entry = json.load(fd)
+        except (IOError, ValueError):
+            return None
+        if not isinstance(entry, dict):
+            return None
+        for path, mtime, size, digest in entry['files']:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return None
+            if stat.st_mtime == mtime and stat.st_size == size:
+                continue
+            if stat.st_size != size or file_digest(path) != digest:
+                return None
+        return entry
+
+    def open(self, args):
+        "Opens the cached output of the command, if it is still valid."
+        entry = self.entry(args)
+        if entry is None:
+            return None
+        try:
+            fd = open(self.path(args, '.out'), 'rb')
+        except IOError:
+            return None
+        stat = os.fstat(fd.fileno())
+        if [stat.st_ino, stat.st_size] != entry['output']:
+            fd.close()
+            return None
+        return fd
+
+    def create(self, args, dependencies=None):
+        """Returns a writer for the output of the command. Unless the
+        dependencies are given, they're read from the line markers of
+        the written output."""
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        return CacheWriter(self, args, dependencies)
+
+class CacheWriter(object):
+    def __init__(self, cache, args, dependencies):
+        self.out_path = cache.path(args, '.out')
+        self.deps_path = cache.path(args, '.deps')
+        self.temp_suffix = '.{}'.format(os.getpid())
+        self.fd = open(self.out_path + self.temp_suffix, 'wb')
+        self.dependencies = dependencies
+
+    def write(self, data):
+        self.fd.write(data)
+
+    def commit(self):
+        self.fd.close()
+        dependencies = self.dependencies
+        if dependencies is None:
+            with open(self.out_path + self.temp_suffix, 'rb') as fd:
+                dependencies = describe_files(line_marker_files(fd))
+        stat = os.stat(self.out_path + self.temp_suffix)
+        with open(self.deps_path + self.temp_suffix, 'w') as fd:
+            json.dump({'output': [stat.st_ino, stat.st_size], 'files': dependencies}, fd)
+        os.rename(self.out_path + self.temp_suffix, self.out_path)
+        os.rename(self.deps_path + self.temp_suffix, self.deps_path)
+        return dependencies
+
+    def abort(self):
+        self.fd.close()
+        os.remove(self.out_path + self.temp_suffix)
+
+def line_marker_files(lines):
+    files = set()
+    for line in lines:
+        if line.startswith('#'):
+            marker = parse_line_marker(line)
+            if marker is not None and not marker[1].startswith('<'):
+                files.add(marker[1])
+    return sorted(files)
+
+def describe_files(paths):
+    dependencies = []
+    for path in paths:
+        stat = os.stat(path)
+        dependencies.append([path, stat.st_mtime, stat.st_size, file_digest(path)])
+    return dependencies
+
+def file_digest(path):
+    with open(path, 'rb') as fd:
+        return hashlib.sha1(fd.read()).hexdigest()
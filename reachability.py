@@ -0,0 +1,150 @@
+import parser
+
+# Computes what is reachable from a set of roots, for the bindings that only
+# need a part of a library. The roots are the C names of functions,
+# variables, typedefs and constants. They're given as a list of names, or a
+# selector like the select_macros of parse: a prefix or a tuple of them, a
+# compiled regex or a function taking the name.
+#
+# The Closure translates the roots, and follows the parameters, return
+# types and struct fields to their types, the typedefs to what they stand
+# for, the enums to their constants, and the array lengths and macros to the
+# constants they refer to. The structs in the blacklist are opaque, so their
+# fields aren't followed. The translated types reached are in `types`, and
+# the report lists the rest of the environment with the reason it was left out.
+
+class Closure(object):
+    def __init__(self, translate, roots):
+        self.translate = translate
+        self.env = translate.env
+        self.variables = {} # The typespecs of the functions and variables, by C name.
+        self.constants = {} # The values of the constants, by C name.
+        self.types = {}     # The translated types reached, as in translate.types.
+        self.typedefs = set()
+        self.records = set()
+        self.enums = set()
+        selected = root_selector(roots)
+        for cname in sorted(self.env.names):
+            if selected(cname):
+                declarator = self.env.names[cname]
+                self.variables[cname] = typespec = translate.declarator(declarator)
+                self.declarator(declarator)
+                self.typespec(typespec)
+        for cname in sorted(self.env.types):
+            if selected(cname):
+                self.typespec(translate.visit_type(cname))
+                self.typedef(cname)
+        for cname in sorted(self.env.constants):
+            if selected(cname):
+                self.constant(cname)
+
+    def reachable(self, cname):
+        "True for the functions, variables and constants in the closure."
+        return cname in self.variables or cname in self.constants
+
+    def declarator(self, declarator):
+        if not isinstance(declarator, parser.Declarator):
+            return
+        for which, params in declarator:
+            if which == 'function':
+                for param in params or ():
+                    self.declarator(param)
+            elif which in ('array', 'bitfield'):
+                self.expression(params)
+        for specifier in declarator.specifiers:
+            if isinstance(specifier, parser.Enum):
+                self.enum(specifier)
+            elif isinstance(specifier, (parser.Structure, parser.Union)):
+                self.record(specifier)
+            elif specifier in self.env.types:
+                self.typedef(specifier)
+
+    def typedef(self, name):
+        if name in self.typedefs:
+            return
+        self.typedefs.add(name)
+        self.declarator(self.env.types[name])
+
+    def record(self, record):
+        if record in self.records:
+            return
+        self.records.add(record)
+        if record.fields is None or record.name in self.translate.blacklist:
+            return
+        for field in record.fields:
+            self.declarator(field)
+
+    def enum(self, enum):
+        if enum.constants is None and enum.name in self.env.enums:
+            enum = self.env.enums[enum.name] # A reference to the tag.
+        if enum in self.enums:
+            return
+        self.enums.add(enum)
+        for name, value in enum.constants or ():
+            self.constant(name)
+
+    def constant(self, name):
+        if name in self.constants or name not in self.env.constants:
+            return
+        self.constants[name] = value = self.env.constants[name]
+        self.expression(value)
+
+    def expression(self, value):
+        for name in parser.names_of(value):
+            self.constant(name)
+
+    def typespec(self, typespec):
+        if isinstance(typespec, basestring):
+            name = typespec.rstrip('*')
+            if name in self.translate.types and name not in self.types:
+                self.types[name] = self.translate.types[name]
+                self.typespec(self.types[name])
+            return
+        for key in ('to', 'ctype', 'restype'):
+            if key in typespec:
+                self.typespec(typespec[key])
+        for argtype in typespec.get('argtypes', ()):
+            self.typespec(argtype)
+        for name, field in typespec.get('fields', ()):
+            self.typespec(field)
+
+    def pruned(self):
+        "The (kind, name, reason) of everything the closure left out."
+        env = self.env
+        report = []
+        for cname, declarator in env.names.iteritems():
+            if cname not in self.variables:
+                kind = 'function' if len(declarator) > 0 and declarator[0][0] == 'function' else 'variable'
+                report.append((kind, cname, "not reachable from the roots"))
+        for name in env.types:
+            if name not in self.typedefs:
+                report.append(('typedef', name, "not reachable from the roots"))
+        reached = set((record.which, record.name) for record in self.records)
+        for which, space in (('struct', env.structs), ('union', env.unions)):
+            for name, record in space.iteritems():
+                if (which, name) not in reached:
+                    report.append((which, name, "not reachable from the roots"))
+                elif record.fields is not None and name in self.translate.blacklist:
+                    report.append((which, name, "fields left out, it's in the blacklist"))
+        reached = set(enum.name for enum in self.enums)
+        for name in env.enums:
+            if name not in reached:
+                report.append(('enum', name, "not reachable from the roots"))
+        for name in env.constants:
+            if name not in self.constants:
+                report.append(('constant', name, "not reachable from the roots"))
+        for name in self.translate.types:
+            if name not in self.types:
+                report.append(('type', name, "translated before, but not reachable from the roots"))
+        return sorted(report)
+
+    def write_report(self, path):
+        with open(path, 'w') as fd:
+            for kind, name, reason in self.pruned():
+                fd.write('{} {}: {}\n'.format(kind, name, reason))
+
+def root_selector(roots):
+    if isinstance(roots, (list, set, frozenset)):
+        roots = set(roots)
+        return lambda name: name in roots
+    return parser.name_selector(roots)
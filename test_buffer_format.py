@@ -0,0 +1,28 @@
+import struct
+import unittest
+from test_parser import parse_source
+from translator import Translator
+
+def struct_of(source, cname):
+    env = parse_source(source + "struct {} *p;\n".format(cname))
+    translate = Translator(env, lambda name: name)
+    translate.buffer_formats = True
+    return translate.declarator(env.names['p'])['to']
+
+class BitfieldTest(unittest.TestCase):
+    def test_bitfields_after_a_field_in_their_unit(self):
+        spec = struct_of("struct c { char c; int x:3; int y:5; char z; };\n", 'c')
+        self.assertEqual(spec['format'], '<B1sBx')
+        self.assertEqual(struct.calcsize(spec['format']), spec['size'])
+
+    def test_wide_bitfield_after_a_field_in_its_unit(self):
+        spec = struct_of("struct l { char c; long long x:40; char d; };\n", 'l')
+        self.assertEqual(spec['format'], '<B5sBx')
+        self.assertEqual(struct.calcsize(spec['format']), spec['size'])
+
+    def test_bitfields_in_units_of_their_own(self):
+        spec = struct_of("struct u { int a:3; int b:30; short s; };\n", 'u')
+        self.assertEqual(struct.calcsize(spec['format']), spec['size'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+from cffi_emitter import CdefEmitter
+from test_parser import parse_source
+from translator import Translator
+
+def cdef_of(source, names, blacklist=()):
+    env = parse_source(source)
+    translate = Translator(env, lambda name: name)
+    translate.blacklist.update(blacklist)
+    variables = {}
+    for cname in names:
+        variables[cname] = {'name': cname, 'type': translate.declarator(env.names[cname])}
+    return CdefEmitter(translate).cdef(variables).splitlines()
+
+class CdefTest(unittest.TestCase):
+    def test_keeps_char_and_const(self):
+        lines = cdef_of("typedef unsigned char Uint8;\n"
+            "struct text { char text[32]; signed char s; };\n"
+            "int load(struct text *t, const unsigned char *key, Uint8 **buf);\n", ['load'])
+        self.assertIn('    char text[32];', lines)
+        self.assertIn('    signed char s;', lines)
+        self.assertIn('typedef unsigned char Uint8;', lines)
+        self.assertIn('int load(struct text *, const unsigned char *, Uint8 **);', lines)
+
+    def test_callback_signature(self):
+        lines = cdef_of("typedef int (*callback)(void *data, const char *const *names);\n"
+            "void set(callback cb);\n", ['set'])
+        self.assertIn('typedef int (*callback)(void *, const char *const *);', lines)
+        self.assertIn('void set(callback);', lines)
+
+    def test_typedef_before_the_struct_using_it(self):
+        lines = cdef_of("typedef struct node node;\nstruct node { node *next; };\n"
+            "node *first(void);\n", ['first'])
+        self.assertLess(lines.index('typedef struct node node;'), lines.index('struct node {'))
+
+    def test_opaque_by_value_is_skipped(self):
+        lines = cdef_of("struct X { int a; };\nvoid f(struct X x);\nvoid g(struct X *x);\n",
+            ['f', 'g'], blacklist=['X'])
+        self.assertIn('void g(struct X *);', lines)
+        self.assertIn('/* skipped f: struct X is opaque, but used by value */', lines)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+from StringIO import StringIO
+from generate import generate, strip_prefix
+
+source = """
+#define LIB_MAX 4
+#define OTHER_MAX 5
+typedef struct lib_pt { int x; } lib_pt;
+typedef struct lib_box { lib_pt a, b; } lib_box;
+typedef struct lib_extra { int y; } lib_extra;
+int lib_area(lib_box *box);
+int lib_norm(lib_pt *pt);
+int other(void);
+"""
+
+def run_generate(environ={}, **options):
+    "The bindings generate prints for the source, with the environment variables set."
+    fd, path = tempfile.mkstemp(suffix='.h')
+    with os.fdopen(fd, 'w') as header:
+        header.write(source)
+    saved = dict(os.environ)
+    stdout = sys.stdout
+    os.environ.update(environ)
+    sys.stdout = StringIO()
+    try:
+        generate('libtest', [path], strip_prefix('lib_'), strip_prefix('LIB_'), strip_prefix('lib_'),
+            **options)
+        return json.loads(sys.stdout.getvalue())
+    finally:
+        sys.stdout = stdout
+        os.environ.clear()
+        os.environ.update(saved)
+        os.remove(path)
+
+class GenerateTest(unittest.TestCase):
+    def test_selects_and_renames(self):
+        bindings = run_generate()
+        self.assertEqual(bindings['constants'], {'MAX': 4})
+        self.assertEqual(sorted(bindings['variables']), ['area', 'norm'])
+        self.assertEqual(bindings['variables']['area']['name'], 'lib_area')
+        self.assertEqual(sorted(bindings['types']), ['box', 'pt'])
+
+    def test_roots(self):
+        bindings = run_generate({'CFFI_GEN_ROOTS': 'lib_norm'})
+        self.assertEqual(sorted(bindings['variables']), ['norm'])
+        self.assertEqual(sorted(bindings['types']), ['pt'])
+
+    def test_extra_types(self):
+        extra_types = lambda cname: cname == 'lib_extra'
+        self.assertIn('extra', run_generate(extra_types=extra_types)['types'])
+        bindings = run_generate({'CFFI_GEN_ROOTS': 'lib_norm'}, extra_types=extra_types)
+        self.assertNotIn('extra', bindings['types'])
+
+    def test_typespecs_inline_by_default(self):
+        bindings = run_generate()
+        self.assertNotIn('typespecs', bindings)
+        self.assertEqual(bindings['variables']['norm']['type']['type'], 'cfunc')
+        self.assertEqual(bindings['types']['pt']['type'], 'struct')
+
+    def test_interned_typespecs(self):
+        bindings = run_generate({'CFFI_GEN_INTERN': '1'})
+        entries = bindings['typespecs']
+        self.assertEqual(entries[bindings['variables']['norm']['type']]['type'], 'cfunc')
+        self.assertEqual(entries[bindings['types']['pt']]['type'], 'struct')
+
+    def test_comment_and_depends(self):
+        bindings = run_generate(comment="hello", depends=['libother'])
+        self.assertEqual(bindings['comment'], "hello")
+        self.assertEqual(bindings['depends'], ['libother'])
+        self.assertNotIn('comment', run_generate())
+
+class StripPrefixTest(unittest.TestCase):
+    def test_prefixes(self):
+        rename = strip_prefix('OVR_', 'ovr')
+        self.assertEqual(rename('OVR_Max'), 'Max')
+        self.assertEqual(rename('ovrSize'), 'Size')
+        self.assertIsNone(rename('ovr'))
+        self.assertIsNone(rename('other'))
+
+if __name__ == '__main__':
+    unittest.main()
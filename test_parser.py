@@ -0,0 +1,94 @@
+import os
+import tempfile
+import unittest
+import parser
+
+def write_header(source):
+    fd, path = tempfile.mkstemp(suffix='.h')
+    with os.fdopen(fd, 'w') as header:
+        header.write(source)
+    return path
+
+def parse_source(source, *args, **options):
+    "Parses the C source as a header, into a default environment."
+    path = write_header(source)
+    try:
+        env = parser.default_env()
+        parser.parse(env, [path], *args, **options)
+        return env
+    finally:
+        os.remove(path)
+
+class TypedefTest(unittest.TestCase):
+    def test_typedef_used_right_after(self):
+        env = parse_source("typedef int foo;\nfoo x;\n")
+        self.assertIn('foo', env.types)
+        self.assertEqual(env.names['x'].specifiers, ['foo'])
+
+    def test_struct_typedef_used_right_after(self):
+        env = parse_source("typedef struct X X; X *f(void);\n")
+        self.assertIn('X', env.types)
+        self.assertEqual(env.names['f'].specifiers, ['X'])
+
+class SignatureTest(unittest.TestCase):
+    def test_positional_lce_and_extra_flags(self):
+        env = parse_source("#ifdef FOO\nint x;\n#endif\n", 3, ['-DFOO'])
+        self.assertIn('x', env.names)
+
+class StreamTest(unittest.TestCase):
+    def test_closed_on_any_error(self):
+        outputs = []
+        open_stream = parser.open_stream
+        def recording_stream(args, cache=None):
+            outputs.append(open_stream(args, cache))
+            return outputs[-1]
+        parser.open_stream = recording_stream
+        path = write_header("int x;\nint y;\n")
+        try:
+            events = parser.iterparse(parser.default_env(), [path], stream=True)
+            next(events)
+            self.assertRaises(KeyError, events.throw, KeyError('x'))
+        finally:
+            parser.open_stream = open_stream
+            os.remove(path)
+        self.assertTrue(outputs[0].fd.closed)
+        self.assertIsNotNone(outputs[0].process.returncode)
+
+class OriginTest(unittest.TestCase):
+    source = ("struct point {\n    int x;\n    int y;\n};\n"
+        "enum color {\n    RED,\n    GREEN\n};\n"
+        "#define LIMIT 4\n")
+
+    def test_records_at_their_tag(self):
+        env = parse_source(self.source)
+        self.assertEqual(env.structs['point'].origin[1], 1)
+        self.assertEqual(env.enums['color'].origin[1], 5)
+        self.assertEqual(env.constant_origins['RED'][1], 6)
+
+    def test_macros_with_single_run(self):
+        self.assertIsNone(parse_source(self.source).constant_origins['LIMIT'])
+        env = parse_source(self.source, single_run=True)
+        self.assertEqual(env.constant_origins['LIMIT'][1], 9)
+
+class RecoverTest(unittest.TestCase):
+    def test_error_after_a_function_definition(self):
+        env = parse_source("int f(void) { return 0; }\nint bad = (1 };\nint y;\n", recover=True)
+        self.assertEqual(len(env.parse_errors), 1)
+        error, first, last = env.parse_errors[0]
+        self.assertEqual((first[1], last[1]), (2, 2))
+        self.assertIn('y', env.names)
+
+class ChunkFilterTest(unittest.TestCase):
+    def test_brackets_in_literals(self):
+        env = parser.default_env()
+        env.chunks = set()
+        env.line_marker = None
+        chunks = parser.ChunkFilter(env, parser.Parser(parser.translation_unit, env))
+        chunks.tokens.extend(parser.scan("char a['('];\n"))
+        chunks.flush()
+        self.assertEqual(chunks.depth, 0)
+        self.assertTrue(chunks.boundary)
+        self.assertEqual(len(env.chunks), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import os
+import shutil
+import tempfile
+import unittest
+from preprocess_cache import PreprocessCache
+
+class CacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = PreprocessCache(self.directory)
+        self.header = os.path.join(self.directory, 'a.h')
+        with open(self.header, 'w') as fd:
+            fd.write('int x;\n')
+        self.args = ['gcc', '-E', self.header]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def store(self, output):
+        writer = self.cache.create(self.args, [])
+        writer.write(output)
+        writer.commit()
+
+    def test_replays_output(self):
+        self.store('int x;\n')
+        with self.cache.open(self.args) as fd:
+            self.assertEqual(fd.read(), 'int x;\n')
+
+    def test_output_of_another_run(self):
+        self.store('int x;\n')
+        # Another run got its .out in, but not yet its .deps.
+        path = self.cache.path(self.args, '.out')
+        with open(path + '.other', 'wb') as fd:
+            fd.write('int y;\n')
+        os.rename(path + '.other', path)
+        self.assertIsNone(self.cache.open(self.args))
+
+    def test_dependency_changed(self):
+        writer = self.cache.create(self.args)
+        writer.write('# 1 "{}"\nint x;\n'.format(self.header))
+        writer.commit()
+        self.assertIsNotNone(self.cache.dependencies(self.args))
+        with open(self.header, 'w') as fd:
+            fd.write('int xy;\n')
+        self.assertIsNone(self.cache.dependencies(self.args))
+        self.assertIsNone(self.cache.open(self.args))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import unittest
+import reachability
+from test_parser import parse_source
+from translator import Translator
+
+source = """
+enum color { RED, GREEN };
+struct pt { int x; enum color c; };
+void use(struct pt *p);
+typedef enum shade { LIGHT, DARK } shade_t;
+void paint(shade_t s);
+void flag(enum { X1, X2 } x);
+void unused(void);
+"""
+
+class ClosureTest(unittest.TestCase):
+    def closure(self, roots):
+        env = parse_source(source)
+        return reachability.Closure(Translator(env, lambda name: name), roots)
+
+    def test_tagged_enum_field(self):
+        closure = self.closure(['use'])
+        self.assertEqual(sorted(closure.constants), ['GREEN', 'RED'])
+
+    def test_typedef_of_tagged_enum(self):
+        closure = self.closure(['paint'])
+        self.assertEqual(sorted(closure.constants), ['DARK', 'LIGHT'])
+
+    def test_anonymous_enum_parameter(self):
+        closure = self.closure(['flag'])
+        self.assertEqual(sorted(closure.constants), ['X1', 'X2'])
+
+    def test_pruned_enums(self):
+        pruned = self.closure(['use']).pruned()
+        self.assertIn(('enum', 'shade', "not reachable from the roots"), pruned)
+        self.assertNotIn(('enum', 'color', "not reachable from the roots"), pruned)
+        self.assertIn(('function', 'unused', "not reachable from the roots"), pruned)
+
+if __name__ == '__main__':
+    unittest.main()
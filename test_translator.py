@@ -0,0 +1,54 @@
+import unittest
+from test_parser import parse_source
+from translator import Translator
+
+class SpecifierTest(unittest.TestCase):
+    def test_struct_pointer_is_single_pointer(self):
+        env = parse_source("struct X;\nstruct X *p;\n")
+        translate = Translator(env, lambda name: name)
+        self.assertEqual(translate.declarator(env.names['p']),
+            {'type': 'pointer', 'to': {'type': 'opaque'}})
+
+    def test_bluelisted_struct_pointer(self):
+        env = parse_source("struct X { int a; };\nstruct X *p;\n")
+        translate = Translator(env, lambda name: name)
+        translate.bluelist['X'] = 'X'
+        self.assertEqual(translate.declarator(env.names['p']), 'X*')
+
+    def test_enum_pointer_is_single_pointer(self):
+        env = parse_source("enum E { A };\nenum E *e;\n")
+        translate = Translator(env, lambda name: name)
+        self.assertEqual(translate.declarator(env.names['e']), 'int*')
+
+class MemoTest(unittest.TestCase):
+    source = "typedef struct foo {int a;} foo_t;\nvoid f(foo_t*);\nvoid g(foo_t*);\n"
+
+    def test_blacklist_change_starts_over(self):
+        env = parse_source(self.source)
+        translate = Translator(env, lambda name: name)
+        translate.declarator(env.names['f'])
+        self.assertEqual(translate.types['foo_t']['type'], 'struct')
+        translate.blacklist.add('foo')
+        translate.declarator(env.names['g'])
+        self.assertEqual(translate.types['foo_t'], {'type': 'opaque'})
+
+    def test_bluelist_change_starts_over(self):
+        env = parse_source(self.source)
+        translate = Translator(env, lambda name: name)
+        translate.declarator(env.names['f'])
+        translate.bluelist['foo'] = 'Foo'
+        translate.declarator(env.names['g'])
+        fresh = Translator(env, lambda name: name)
+        fresh.bluelist['foo'] = 'Foo'
+        fresh.declarator(env.names['g'])
+        self.assertEqual(translate.types, fresh.types)
+        self.assertIn('Foo', translate.types)
+
+    def test_same_declarator_gives_same_typespec(self):
+        env = parse_source(self.source)
+        translate = Translator(env, lambda name: name)
+        typespec = translate.declarator(env.names['f'])
+        self.assertIs(translate.declarator(env.names['f']), typespec)
+
+if __name__ == '__main__':
+    unittest.main()
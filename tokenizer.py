@@ -1,3 +1,5 @@
+import re
+
 keywords = set(
     "typedef char int short long unsigned signed struct static __inline inline __inline__ "
     "__restrict __extension__ __signed__ union volatile enum __asm__ double float "
@@ -166,6 +168,97 @@ def parse_escape_sequence(stream):
         return chr(int(num, 16))
     raise Exception("invalid escape sequence %c" % character)
 
+# The scan() produces the same tokens as tokenize(), but it matches
+# whole tokens with one compiled regex instead of walking the source
+# one character at a time.
+def scan(source):
+    return scan_chunks([source])
+
+# The scan_chunks() tokenizes text arriving in pieces, eg. from a pipe.
+# A match that reaches the end of the buffered text may continue in the
+# next chunk, so it is retried once more text has arrived.
+def scan_chunks(chunks):
+    chunks = iter(chunks)
+    match_token = token_regex.match
+    lineno = 1
+    source = ''
+    index = 0
+    end = 0
+    final = False
+    while True:
+        match = match_token(source, index) if index < end else None
+        if match is None or (match.end() == end and not final):
+            if final:
+                if index < end:
+                    raise Exception("invalid character %c" % source[index])
+                return
+            chunk = next(chunks, None)
+            if chunk is None:
+                final = True
+            else:
+                source = source[index:] + chunk
+                index = 0
+                end = len(source)
+            continue
+        kind = match.lastgroup
+        text = match.group()
+        index = match.end()
+        if kind == 'name':
+            if text in keywords:
+                yield lineno, text.upper(), text
+            elif text in reserved:
+                yield lineno, 'RESERVED', text
+            elif text in ('true', 'false'):
+                yield lineno, 'BOOLCONSTANT', text
+            else:
+                yield lineno, 'IDENTIFIER', text
+        elif kind == 'operator':
+            yield lineno, operators[text], text
+        elif kind == 'space':
+            lineno += text.count('\n')
+        elif kind == 'number':
+            if match.group('exponent') is not None and not match.group('exponent_digits'):
+                raise Exception("expected digit %r" % match.group('number_text'))
+            if match.group('fraction') is None and match.group('exponent') is None:
+                yield lineno, 'INTCONSTANT', int(match.group('number_text'))
+            else:
+                yield lineno, 'FLOATCONSTANT', float(match.group('number_text'))
+        elif kind == 'hex':
+            yield lineno, 'INTCONSTANT', int(match.group('hex_text'), 16)
+        elif kind == 'octal':
+            yield lineno, 'INTCONSTANT', int(match.group('octal_text'), 8)
+        elif kind == 'macro':
+            yield lineno, 'MACRO', text
+            lineno += text.count('\n')
+        elif kind == 'string':
+            yield lineno, 'STRING', escape_regex.sub(unescape, match.group('string_body'))
+            lineno += text.count('\n')
+        elif kind == 'character':
+            first = escape_regex.sub(unescape, match.group('character_first'))
+            yield lineno, 'CHARACTER', first + match.group('character_rest')
+            lineno += text.count('\n')
+
+# gcc writes the line markers as: # linenum "filename" flags
+def parse_line_marker(text):
+    "Returns the (linenum, filename) of a line marker, or None."
+    match = line_marker_regex.match(text)
+    if match is not None:
+        return int(match.group(1)), re.sub(r'\\(.)', r'\1', match.group(2))
+
+line_marker_regex = re.compile(r'#\s*(?:line\s+)?(\d+)\s+"((?:\\.|[^"\\])*)"')
+
+def unescape(match):
+    character = match.group(1)
+    if character in escape_sequences:
+        return escape_sequences[character]
+    if isdigit(character[0]):
+        return chr(int(character, 8))
+    if character[0] == 'x':
+        return chr(int(character[1:], 16))
+    raise Exception("invalid escape sequence %c" % character)
+
+escape_regex = re.compile(r"\\([0-9]{1,3}|x[0-9a-fA-F]{0,2}|[\s\S])")
+
 # operator precedence table on page 40
 operators = {
     "(":'LEFT_PAREN',
@@ -240,3 +333,18 @@ def isoctal(ch):
 
 def isdigit(ch):
     return '0' <= ch <= '9'
+
+token_regex = re.compile(r"""
+    (?P<space>      [ \t\r\n]+ | /\*[\s\S]*?(?:\*/|\Z) | //[^\n]* )
+  | (?P<macro>      \#(?:\\[\s\S]?|[^\n\\])* )
+  | (?P<name>       [A-Za-z_][A-Za-z0-9_]* )
+  | (?P<hex>        (?P<hex_text>0[xX][0-9a-fA-F]*)[A-Za-z]* )
+  | (?P<octal>      (?P<octal_text>0(?!\.)[0-7]*)[A-Za-z]* )
+  | (?P<number>     (?P<number_text>[0-9]+(?P<fraction>\.[0-9]*)?
+                        (?P<exponent>[eE][+-]?(?P<exponent_digits>[0-9]*))?)[A-Za-z]* )
+  | (?P<operator>   {operators} )
+  | (?P<character>  '(?P<character_first>\\(?:[0-9]{{1,3}}|x[0-9a-fA-F]{{0,2}}|[\s\S])|[\s\S])
+                        (?P<character_rest>[^']*)' )
+  | (?P<string>     "(?P<string_body>(?:\\[\s\S]|[^"\\])*)" )
+""".format(operators='|'.join(re.escape(op)
+    for op in sorted(operators, key=len, reverse=True))), re.VERBOSE)
@@ -1,3 +1,5 @@
+import buffer_format
+import layout
 import parser
 
 primitive_types = {
@@ -37,29 +39,61 @@ class Translator(object):
         self.env = env
         self.rename_type = rename_type
         self.dependency = dependency
-        self.alias = {} # Maps c names to translated names.
+        self.alias = {} # Maps typedefs to their translated names.
+        self.memo = {} # Maps declarators to their typespecs.
+        self.memo_configuration = None
         self.renamings = {} # umm...
         self.types = {}
         self.shadow_types = {}
         self.translated = set()
         self.blacklist = set() # Blacklist turns structs opaque
         self.bluelist = {} # Bluelist renames structs/unions
+        self.layout = layout.Layout(env)
+        self.buffer_formats = False # Adds struct module formats to the records and arrays.
+        self.formats = buffer_format.Formats(self.types, self.layout.abi)
 
     def declarator(self, declarator):
+        self.check_memo()
+        return self.memoized(declarator)
+
+    # The typespec of a declarator is translated once, and the same object is
+    # given every time the declarator is reached again, as a parameter, a
+    # field or a name. The typedefs are remembered in the alias. The
+    # translation depends on the renaming, the dependency hook, the
+    # blacklist, the bluelist and the buffer formats. When one of them
+    # changes, everything translated so far is forgotten, the types too,
+    # and the declarators have to be translated again.
+    def check_memo(self):
+        configuration = (self.rename_type, self.dependency, self.buffer_formats,
+            frozenset(self.blacklist), frozenset(self.bluelist.iteritems()))
+        if configuration != self.memo_configuration:
+            self.memo.clear()
+            self.alias.clear()
+            self.translated.clear()
+            self.types.clear() # Cleared in place, self.formats refers to it.
+            self.shadow_types.clear()
+            self.renamings.clear()
+            self.memo_configuration = configuration
+
+    def memoized(self, declarator):
         if declarator is Ellipsis:
             raise Exception("vararg")
+        if declarator in self.memo:
+            return self.memo[declarator]
         # C declarators have a specifier, with modifiers
         # stacked on top. We go through the stack and
         # produce the typespec.
         typespec = self.specifiers(declarator)
-        return self.declarator_chain(declarator, typespec)
+        typespec = self.declarator_chain(declarator, typespec)
+        self.memo[declarator] = typespec
+        return typespec
 
     def declarator_chain(self, declarator, typespec):
         for which, params in reversed(declarator):
             if which == 'function':
                 if params is None:
                     params = []
-                argtypes = [self.declarator(param) for param in params if param != Ellipsis]
+                argtypes = [self.memoized(param) for param in params if param != Ellipsis]
                 if argtypes == ['void']:
                     argtypes = []
                 typespec = {"type": "cfunc",
@@ -73,7 +107,11 @@ class Translator(object):
                 else:
                     typespec = {"type": "pointer", "to": typespec}
             elif which == 'array':
-                typespec = {"type": "array", "ctype": typespec, "length": params}
+                typespec = {"type": "array", "ctype": typespec, "length": self.constant(params)}
+                if self.buffer_formats and typespec['length'] is not None:
+                    self.buffer_format(typespec, 'format', self.formats.array)
+            elif which == 'bitfield':
+                typespec = {"type": "bitfield", "ctype": typespec, "width": self.constant(params)}
             else:
                 # If this happens, just fill up the missing specs and the results
                 # they should translate to.
@@ -87,26 +125,29 @@ class Translator(object):
         if len(declarator.specifiers) == 1:
             typename = declarator.specifiers[0]
             if is_structure_union(declarator):
-                if declarator is None:
-                    assert False # hmm...
-                return self.typedecl(declarator)
+                return self.record(typename)
             elif isinstance(typename, parser.Enum):
-                return self.declarator_chain(declarator, 'int')
+                return 'int'
             elif isinstance(typename, str):
                 return self.visit_type(typename)
         raise Exception("Translator for specifier not implemented: %r" % declarator.specifiers)
 
     def visit_type(self, typename):
+        self.check_memo()
         typedecl = self.env.types[typename]
         if typedecl in self.alias:
             return self.alias[typedecl]
+        self.alias[typedecl] = name = self.translate_type(typename, typedecl)
+        return name
+
+    def translate_type(self, typename, typedecl):
         aliased = unroll_typedef(self.env, typedecl)
         if isinstance(aliased, str):
-            self.alias[typedecl] = aliased
             return aliased
         else:
             dependency = self.dependency(typename)
             if dependency is not None:
+                self.renamings[typename] = dependency
                 return dependency
             if self.visit(typename):
                 if typedecl is None:
@@ -124,30 +165,68 @@ class Translator(object):
         if typedecl is None:
             assert False # hmm...
         if is_structure_union(typedecl):
-            typespec = typedecl.specifiers[0]
-            if typespec.name in self.bluelist and not self.visit(typespec):
-                res = self.bluelist[typespec.name]
-            elif typespec.fields is None or typespec.name in self.blacklist:
-                res = {'type': 'opaque'}
-            else:
-                fields = []
-                res = {'type': typespec.which, 'fields': fields}
-                if typespec.name is not None:
-                    assert typespec.name not in self.shadow_types, typespec.name
-                    # At this point, you may add the type to blacklisted list.
-                    # ...Or into bluelist, if you want it in anyway.
-                    self.shadow_types[typespec.name] = res
-                if typespec.name in self.bluelist:
-                    name = self.bluelist[typespec.name]
-                    assert name not in self.types, name
-                    self.types[name] = res
-                    res = name
-                for field in typespec.fields:
-                    fields.append([field.name, self.declarator(field)])
+            res = self.record(typedecl.specifiers[0])
         else:
             res = self.specifiers(typedecl)
         return self.declarator_chain(typedecl, res)
 
+    def record(self, typespec):
+        if typespec.name in self.bluelist and not self.visit(typespec):
+            return self.bluelist[typespec.name]
+        elif typespec.fields is None or typespec.name in self.blacklist:
+            return {'type': 'opaque'}
+        fields = []
+        res = spec = {'type': typespec.which, 'fields': fields}
+        if typespec.name is not None:
+            assert typespec.name not in self.shadow_types, typespec.name
+            # At this point, you may add the type to blacklisted list.
+            # ...Or into bluelist, if you want it in anyway.
+            self.shadow_types[typespec.name] = res
+        if typespec.name in self.bluelist:
+            name = self.bluelist[typespec.name]
+            assert name not in self.types, name
+            self.types[name] = res
+            res = name
+        for field in typespec.fields:
+            fields.append([field.name, self.memoized(field)])
+        self.record_layout(spec, typespec)
+        if self.buffer_formats:
+            if spec['type'] == 'union':
+                self.buffer_format(spec, 'formats', self.formats.union)
+            else:
+                self.buffer_format(spec, 'format', self.formats.struct)
+        return res
+
+    # The size and align of a struct or union are in bytes, and so are the
+    # offsets of its fields. A bitfield's offset is that of the storage unit
+    # it's in, and the "shifts" list has its bit position within the unit.
+    def record_layout(self, spec, record):
+        try:
+            result = self.layout.record(record)
+        except layout.LayoutError:
+            return
+        spec['size'] = result.size
+        spec['align'] = result.align
+        spec['offsets'] = result.offsets
+        if any(shift is not None for shift in result.shifts):
+            spec['shifts'] = result.shifts
+
+    # The struct module format of a struct or a fixed-length array, and of
+    # every member of a union. Left out if some part has no format.
+    def buffer_format(self, spec, key, format):
+        try:
+            spec[key] = format(spec)
+        except buffer_format.FormatError:
+            pass
+
+    def constant(self, value):
+        if value is None:
+            return None
+        try:
+            return self.layout.constant(value)
+        except layout.LayoutError:
+            return value
+
     def rename(self, name):
         renamed = self.rename_type(name)
         self.renamings[name] = renamed
@@ -207,3 +286,42 @@ def primitive_type(declarator):
 
 def is_function(typespec):
     return isinstance(typespec, dict) and typespec['type'] == 'cfunc'
+
+# The TypeTable gives every distinct typespec one entry, so that a type used
+# by many functions appears once in the output. Inside the entries, the nested
+# typespecs are replaced by the ids of their entries, and an entry only refers
+# to the entries before it. Primitive and named types stay as strings.
+class TypeTable(object):
+    def __init__(self):
+        self.entries = []
+        self.index = {}
+
+    def intern(self, typespec):
+        "The id of the typespec's entry, or the typespec if it's a string."
+        if isinstance(typespec, basestring):
+            return typespec
+        entry = {}
+        for key, value in typespec.iteritems():
+            if key in ('to', 'ctype', 'restype'):
+                value = self.intern(value)
+            elif key == 'argtypes':
+                value = [self.intern(argtype) for argtype in value]
+            elif key == 'fields':
+                value = [[name, self.intern(field)] for name, field in value]
+            entry[key] = value
+        key = freeze(entry)
+        if key not in self.index:
+            self.index[key] = len(self.entries)
+            self.entries.append(entry)
+        return self.index[key]
+
+    def intern_names(self, types):
+        "Interns the values of a dict, in the order of the names for stable ids."
+        return dict((name, self.intern(types[name])) for name in sorted(types))
+
+def freeze(value):
+    if isinstance(value, dict):
+        return tuple(sorted((key, freeze(item)) for key, item in value.iteritems()))
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value